@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Benchmark the sync and async engines against the fake panel.
+
+Times one full refresh (home.php plus getstatsdiskusage for every VM)
+for each engine at several fleet sizes and concurrency levels.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_panel import FakePanel  # noqa: E402
+import racknerd_exporter as exporter  # noqa: E402
+
+
+def make_poller(engine: str, url: str, concurrency: int) -> exporter.RackNerdPoller:
+    if engine == 'async':
+        client = exporter.AsyncRackNerdClient(url, 'user', 'pass', pool_size=concurrency)
+        return exporter.AsyncRackNerdPoller(client, concurrency)
+    client = exporter.RackNerdClient(url, 'user', 'pass', pool_size=concurrency)
+    return exporter.RackNerdPoller(client, concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--vms', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 64])
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Fake panel latency per request in seconds (default: 0.05)')
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f"{'engine':<7} {'vms':>6} {'conc':>5} {'best s':>8} {'mean s':>8}")
+    for vm_count in args.vms:
+        panel = FakePanel(vm_count, args.latency).start()
+        for concurrency in args.concurrency:
+            for engine in ('sync', 'async'):
+                poller = make_poller(engine, panel.url, concurrency)
+                poller.login()
+                timings = []
+                for _ in range(args.rounds):
+                    start = time.perf_counter()
+                    snapshot = poller.refresh()
+                    timings.append(time.perf_counter() - start)
+                    assert len(snapshot.vms) == vm_count
+                print(f"{engine:<7} {vm_count:>6} {concurrency:>5} "
+                      f"{min(timings):>8.3f} {sum(timings) / len(timings):>8.3f}")
+        panel.stop()
+
+
+if __name__ == '__main__':
+    main()
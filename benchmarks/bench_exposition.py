@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark /metrics with and without the per-snapshot cache of MetricsApp.
+
+Seeds every VM's stats as one interval old, so the poller is in steady
+state from the start: one VM is polled every interval/VMs seconds, and the
+polls are published together at most once per --publish-interval. Then
+scrapes /metrics from several threads for a fixed time, for plain text,
+OpenMetrics and gzip, through prometheus_client's make_wsgi_app (before)
+and through MetricsApp (after). Reports scrapes per second, and for
+MetricsApp the renders of the per-VM and fleet families and the scrapes
+served from the cache, as counted by the app.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_panel import FakePanel  # noqa: E402
+from prometheus_client import CollectorRegistry, make_wsgi_app  # noqa: E402
+import racknerd_exporter as exporter  # noqa: E402
+
+VARIANTS = {
+    'text': {'Accept-Encoding': 'identity'},
+    'text+gzip': {'Accept-Encoding': 'gzip'},
+    'openmetrics': {'Accept': 'application/openmetrics-text; version=1.0.0',
+                    'Accept-Encoding': 'identity'},
+}
+
+
+def scrape_rate(url: str, headers: dict, threads: int, duration: float) -> float:
+    """Scrape url from several threads for duration seconds, returning scrapes per second."""
+    counts = [0] * threads
+    stop = time.perf_counter() + duration
+
+    def worker(index: int):
+        session = requests.Session()
+        while time.perf_counter() < stop:
+            session.get(url, headers=headers).content
+            counts[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(counts) / duration
+
+
+def steady_poller(panel: FakePanel, interval: float, publish_interval: float) -> exporter.RackNerdPoller:
+    """A started poller whose VMs were all last polled one interval ago."""
+    client = exporter.RackNerdClient(panel.url, 'user', 'pass', pool_size=16)
+    poller = exporter.RackNerdPoller(client, 16, interval=interval,
+                                     publish_interval=publish_interval)
+    poller.login()
+    vms = exporter.parse_vm_list(panel.home_page())
+    poller.inventory.get(lambda: vms)
+    polled_at = time.time() - interval
+    for vm in vms:
+        poller.stats_schedule.store(vm['vm_id'], panel.vm_stats(vm['vm_id']), polled_at)
+    poller.publish(0.0)
+    poller.start()
+    return poller
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--vms', type=int, nargs='+', default=[10, 200, 1000])
+    parser.add_argument('--interval', type=float, default=60.0,
+                        help='Refresh interval of the poller (default: 60)')
+    parser.add_argument('--publish-interval', type=float, default=15.0,
+                        help='Least seconds between snapshots (default: 15)')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5.0,
+                        help='Seconds to scrape each variant (default: 5)')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f"{'vms':>6} {'variant':<12} {'before req/s':>13} {'after req/s':>12} {'renders':>8} {'hits':>6}")
+    for vm_count in args.vms:
+        panel = FakePanel(vm_count).start()
+        poller = steady_poller(panel, args.interval, args.publish_interval)
+
+        registry = CollectorRegistry()
+        collector = exporter.RackNerdCollector({'bench': poller})
+        registry.register(collector)
+        cached_app = exporter.MetricsApp(registry, collector)
+        apps = {'before': make_wsgi_app(registry), 'after': cached_app}
+        servers = {name: exporter.start_http_server(0, app) for name, app in apps.items()}
+        urls = {name: f'http://127.0.0.1:{httpd.server_address[1]}/metrics'
+                for name, httpd in servers.items()}
+
+        for variant, headers in VARIANTS.items():
+            before = scrape_rate(urls['before'], headers, args.threads, args.duration)
+            renders, hits = cached_app.renders, cached_app.hits
+            after = scrape_rate(urls['after'], headers, args.threads, args.duration)
+            print(f"{vm_count:>6} {variant:<12} {before:>13.1f} {after:>12.1f} "
+                  f"{cached_app.renders - renders:>8} {cached_app.hits - hits:>6}")
+
+        for httpd in servers.values():
+            httpd.shutdown()
+        poller.stop()
+        panel.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark size parsing: SizeParser vs the original parse_size.
+
+Times each parser per value over typical panel columns (the size fields
+of every VM, as the fake panel returns them) and adversarial ones: a new
+string on every call, which never hits the cache, overlong numbers and
+garbage. Checks that both parsers agree wherever the original parses.
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_panel import FakePanel  # noqa: E402
+import racknerd_exporter as exporter  # noqa: E402
+
+SIZE_FIELDS = ('totalbw', 'usedbw', 'totalhdd', 'usedhdd', 'totalmem', 'usedmem',
+               'totalvswap', 'usedvswap')
+
+
+def parse_size_original(size_str: str) -> float:
+    """The original parser: inline pattern and unit table on every call."""
+    if not size_str or size_str == 'null':
+        return 0.0
+
+    size_str = size_str.strip()
+    match = re.match(r'([\d.]+)\s*(GB|MB|TB|KB)?', size_str, re.IGNORECASE)
+    if not match:
+        return 0.0
+
+    value = float(match.group(1))
+    unit = (match.group(2) or 'GB').upper()
+
+    multipliers = {
+        'KB': 1024,
+        'MB': 1024 ** 2,
+        'GB': 1024 ** 3,
+        'TB': 1024 ** 4
+    }
+
+    return value * multipliers.get(unit, 1024 ** 3)
+
+
+def columns(vm_count: int) -> Dict[str, List[str]]:
+    """Input columns of vm_count values each, unique ones at least 5000."""
+    panel = FakePanel(vm_count)
+    stats = [panel.vm_stats(str(1000 + i)) for i in range(vm_count)]
+    return {
+        'typical': [vm[field] for vm in stats for field in SIZE_FIELDS][:vm_count],
+        # More distinct values than the parser's cache holds
+        'unique': [f'{i}.{i % 97:02d} GB' for i in range(max(vm_count, 5000))],
+        'long': [f'{"9" * 200}{i} MB' for i in range(vm_count)],
+        'garbage': [('GB', 'null', '', 'n/a', ' - ')[i % 5] for i in range(vm_count)],
+    }
+
+
+def best_ns(parse: Callable[[List[str]], object], values: List[str], repeat: int) -> float:
+    """Best time per value in nanoseconds over repeat runs."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(values)
+        best = min(best, time.perf_counter() - start)
+    return best / len(values) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--values', type=int, default=10000,
+                        help='Values per column (default: 10000)')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'input':<8} {'original ns':>12} {'uncached ns':>12} {'parse ns':>9}")
+    for name, values in columns(args.values).items():
+        checker = exporter.SizeParser()
+        for value in values:
+            try:
+                expected = parse_size_original(value)
+            except ValueError:
+                continue
+            actual = checker.parse(value)
+            assert actual == expected, (value, expected, actual)
+
+        # Runs reuse the parser: repeated values hit its cache, unique ones
+        # outnumber it and keep evicting each other
+        size_parser = exporter.SizeParser()
+        results = (
+            best_ns(lambda values: [parse_size_original(value) for value in values], values, args.repeat),
+            best_ns(lambda values: [size_parser.parse_uncached(value) for value in values],
+                    values, args.repeat),
+            best_ns(lambda values: [size_parser.parse(value) for value in values], values, args.repeat),
+        )
+        print(f"{name:<8} {results[0]:>12.0f} {results[1]:>12.0f} {results[2]:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
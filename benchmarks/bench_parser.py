@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmark home.php parsing: lxml fast path vs the original BeautifulSoup parser.
+
+Reports parse time and peak memory (growth of peak RSS, measured in a
+fresh subprocess per run, Linux only) for pages of increasing size, after checking that
+both parsers return the same VMs.
+"""
+
+import argparse
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bs4 import BeautifulSoup  # noqa: E402
+from fake_panel import FakePanel  # noqa: E402
+import racknerd_exporter as exporter  # noqa: E402
+
+
+def parse_vm_list_soup(html: str) -> List[Dict]:
+    """The original parser: full BeautifulSoup tree of the whole page."""
+    soup = BeautifulSoup(html, 'html.parser')
+    vms = []
+    table = soup.find('table', {'id': 'vmlist'})
+    if not table:
+        return []
+    tbody = table.find('tbody')
+    if not tbody:
+        return []
+    for row in tbody.find_all('tr'):
+        cells = row.find_all('td')
+        if len(cells) < 6:
+            continue
+        link = cells[1].find('a')
+        if not link:
+            continue
+        vm_id_match = re.search(r'\?_v=([^&]+)', link.get('href', ''))
+        if not vm_id_match:
+            continue
+        vms.append({
+            'vm_id': vm_id_match.group(1),
+            'hostname': link.text.strip(),
+            'vm_type': 'kvm' if 'kvm.png' in str(cells[0]) else 'openvz',
+            'ip_address': cells[2].text.strip(),
+            'os': cells[3].text.strip(),
+            'memory': cells[4].text.strip(),
+            'disk': cells[5].text.strip()
+        })
+    return vms
+
+
+PARSERS = {
+    'soup': parse_vm_list_soup,
+    'lxml': exporter.parse_vm_list,
+}
+
+
+def home_page(rows: int) -> str:
+    panel = FakePanel(rows)
+    panel.server.server_close()
+    # Pad the page like the real client area, which is mostly not the table
+    filler = '<div class="menu">' + '<a href="#">item</a>' * 200 + '</div>'
+    return panel.home_page().replace('<body>', '<body>' + filler * 5)
+
+
+def peak_rss_kib() -> int:
+    """Peak resident set size of this process (Linux).
+
+    Read from /proc rather than getrusage, whose ru_maxrss a subprocess
+    inherits from its parent.
+    """
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return 0
+
+
+def measure(parser: str, path: str, rounds: int):
+    """Run in a subprocess: print best parse time and peak RSS growth in KiB."""
+    logging.disable(logging.CRITICAL)
+    with open(path) as f:
+        html = f.read()
+    baseline = peak_rss_kib()
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        PARSERS[parser](html)
+        timings.append(time.perf_counter() - start)
+    peak = peak_rss_kib() - baseline
+    print(min(timings), peak)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--measure', nargs=2, metavar=('PARSER', 'FILE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure[0], args.measure[1], args.rounds)
+        return
+
+    logging.disable(logging.CRITICAL)
+    print(f"{'rows':>6} {'parser':<6} {'best ms':>9} {'peak KiB':>9}")
+    for rows in args.rows:
+        html = home_page(rows)
+        assert parse_vm_list_soup(html) == exporter.parse_vm_list(html), "parsers disagree"
+        # The page is handed over in a file so building it does not count
+        # towards the subprocess' peak memory
+        with tempfile.NamedTemporaryFile('w', suffix='.html', delete=False) as f:
+            f.write(html)
+        for name in PARSERS:
+            output = subprocess.check_output([
+                sys.executable, __file__, '--rounds', str(args.rounds), '--measure', name, f.name
+            ], text=True)
+            best, peak = output.split()
+            print(f"{rows:>6} {name:<6} {float(best) * 1000:>9.2f} {int(peak):>9}")
+        os.unlink(f.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+End-to-end scrape benchmark against the fake panel.
+
+Serves /metrics exactly as the exporter does and scrapes it over HTTP,
+reporting scrape latency and panel requests per scrape as the fleet grows.
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_engines import make_poller  # noqa: E402
+from fake_panel import FakePanel  # noqa: E402
+from prometheus_client import CollectorRegistry, make_wsgi_app  # noqa: E402
+import racknerd_exporter as exporter  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--vms', type=int, nargs='+', default=[10, 50, 200, 1000])
+    parser.add_argument('--scrapes', type=int, default=5)
+    parser.add_argument('--engine', default='sync', choices=['sync', 'async'])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--expire-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f"{'vms':>6} {'p50 s':>8} {'max s':>8} {'req/scrape':>11} {'login.php':>9} {'bytes':>9}")
+    for vm_count in args.vms:
+        panel = FakePanel(vm_count, args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                          expire_rate=args.expire_rate, seed=vm_count).start()
+        poller = make_poller(args.engine, panel.url, args.concurrency)
+        poller.login()
+
+        registry = CollectorRegistry()
+        registry.register(exporter.RackNerdCollector({'bench': poller}))
+        httpd = exporter.start_http_server(0, exporter.ScrapeMiddleware(make_wsgi_app(registry)))
+        url = f'http://127.0.0.1:{httpd.server_address[1]}/metrics'
+
+        panel.reset_counts()
+        timings = []
+        size = 0
+        for _ in range(args.scrapes):
+            start = time.perf_counter()
+            response = requests.get(url)
+            timings.append(time.perf_counter() - start)
+            size = len(response.content)
+
+        logins = panel.requests.get('/login.php', 0)
+        print(f"{vm_count:>6} {statistics.median(timings):>8.3f} {max(timings):>8.3f} "
+              f"{panel.total_requests() / args.scrapes:>11.1f} {logins:>9} {size:>9}")
+        httpd.shutdown()
+        panel.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Benchmark snapshot memory and time: columns vs the original per-VM dicts.
+
+The original snapshot kept the 7-key dict parsed from home.php and the
+raw getstatsdiskusage dict of every VM, and the collector parsed them on
+every scrape. The columnar snapshot keeps interned label columns and one
+array per metric, parsed once per poll. Reports memory retained by the
+VM list, cached stats and snapshot (tracemalloc), the time to publish a
+snapshot after polling one VM, and the time to collect the per-VM
+metrics for one scrape.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fake_panel import FakePanel  # noqa: E402
+from prometheus_client.core import GaugeMetricFamily  # noqa: E402
+import racknerd_exporter as exporter  # noqa: E402
+
+
+def panel_data(vm_count: int):
+    """VM list and stats as separate objects per VM, like parsed responses."""
+    panel = FakePanel(vm_count)
+    vms = exporter.parse_vm_list(panel.home_page())
+    stats = {vm['vm_id']: json.loads(json.dumps(panel.vm_stats(vm['vm_id']))) for vm in vms}
+    return vms, stats
+
+
+class DictSnapshot:
+    """The original layout: per-VM dicts, parsed by the collector on every scrape."""
+
+    def __init__(self, vms: List[Dict], stats: Dict[str, Dict]):
+        self.vms = tuple(vms)
+        self.cache = {vm_id: (vm_stats, time.time()) for vm_id, vm_stats in stats.items()}
+        self.size_parser = exporter.SizeParser()
+        self.snapshot = None
+        self.publish()
+
+    def publish(self):
+        stats = tuple(self.cache[vm['vm_id']][0] for vm in self.vms)
+        fetched_at = tuple(self.cache[vm['vm_id']][1] for vm in self.vms)
+        self.snapshot = (self.vms, stats, fetched_at)
+
+    def collect(self) -> List[GaugeMetricFamily]:
+        parsers = {'size': self.size_parser.parse, 'percent': float, 'state': int}
+        families = {metric.name: GaugeMetricFamily(metric.name, metric.documentation,
+                                                   labels=['account', 'hostname'])
+                    for metric in exporter.STATS_METRICS}
+        vm_info = GaugeMetricFamily('racknerd_vm_info', 'Information about the VM',
+                                    labels=['account', 'hostname', 'ip_address', 'os', 'vm_type'])
+        for vm, stats, _ in zip(*self.snapshot):
+            vm_info.add_metric(['bench', vm['hostname'], vm['ip_address'], vm['os'], vm['vm_type']], 1)
+            for group in exporter.STATS_SCHEMA:
+                if group.gate is not None:
+                    reported = stats.get(group.gate)
+                    if not reported or (group.null_unset and reported == 'null'):
+                        continue
+                for metric in group.metrics:
+                    families[metric.name].add_metric(['bench', vm['hostname']],
+                                                     parsers[metric.parser](stats.get(metric.field, '0')))
+        return [vm_info, *families.values()]
+
+
+class ColumnSnapshot:
+    """The exporter's layout, built by a RackNerdPoller without a panel."""
+
+    def __init__(self, vms: List[Dict], stats: Dict[str, Dict]):
+        self.poller = exporter.RackNerdPoller(client=None)
+        self.poller.inventory.get(lambda: vms)
+        now = time.time()
+        for vm_id, vm_stats in stats.items():
+            self.poller.stats_schedule.store(vm_id, vm_stats, now)
+        self.poller.publish(0.0)
+        self.collector = exporter.RackNerdCollector({'bench': self.poller})
+        self.vm_id = vms[0]['vm_id']
+
+    def publish(self):
+        self.poller.publish(0.0, (self.vm_id,))
+
+    def collect(self) -> List[GaugeMetricFamily]:
+        return list(self.collector.collect_vm_metrics([('bench', self.poller.snapshot)]))
+
+
+def retained_kib(layout_class, vm_count: int) -> float:
+    """Memory still allocated by a layout once the parsed responses are dropped."""
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    vms, stats = panel_data(vm_count)
+    layout = layout_class(vms, stats)
+    del vms, stats
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del layout
+    return size / 1024
+
+
+def best_ms(func: Callable[[], object], repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--vms', type=int, nargs='+', default=[10, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+
+    print(f"{'vms':>6} {'layout':<8} {'memory KiB':>11} {'publish ms':>11} {'collect ms':>11}")
+    for vm_count in args.vms:
+        for name, layout_class in (('dicts', DictSnapshot), ('columns', ColumnSnapshot)):
+            memory = retained_kib(layout_class, vm_count)
+            layout = layout_class(*panel_data(vm_count))
+            publish = best_ms(layout.publish, args.repeat)
+            collect = best_ms(layout.collect, args.repeat)
+            print(f"{vm_count:>6} {name:<8} {memory:>11.0f} {publish:>11.3f} {collect:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Fake RackNerd control panel
+
+Serves login.php, home.php and _vm_remote.php locally so the exporter can
+be exercised without credentials or a live panel. Latency, jitter, error
+rate, session expiry and every login.php status can be injected.
+
+login.php statuses: 1 = success, 2 = blacklisted after too many failed
+logins, 3 = invalid username or password, 4 = 2FA required.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+import secrets
+
+
+HOME_TEMPLATE = '''<html>
+<head><title>Client Area</title></head>
+<body>
+<a href="logout.php">Logout</a>
+<table id="vmlist">
+<thead><tr><th></th><th>Hostname</th><th>IP</th><th>OS</th><th>Memory</th><th>Disk</th></tr></thead>
+<tbody>
+{rows}
+</tbody>
+</table>
+</body>
+</html>'''
+
+ROW_TEMPLATE = (
+    '<tr><td><img src="images/{vm_type}.png"></td>'
+    '<td><a href="control.php?_v={vm_id}">{hostname}</a></td>'
+    '<td>{ip_address}</td><td>Debian 12 64 bit</td><td>2 GB</td><td>40 GB</td></tr>'
+)
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    """Threaded server that ignores clients hanging up mid-response."""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+class FakePanel:
+    """In-process fake panel serving a configurable number of VMs.
+
+    latency + uniform(0, jitter) seconds are added to every response.
+    error_rate is the chance that home.php or _vm_remote.php answers 500.
+    Concurrent _vm_remote.php requests beyond max_concurrency answer 429.
+    Sessions expire session_ttl seconds after login, and each authenticated
+    request expires its session with probability expire_rate.
+    """
+
+    def __init__(self, vm_count: int = 10, latency: float = 0.0, port: int = 0,
+                 jitter: float = 0.0, error_rate: float = 0.0,
+                 session_ttl: Optional[float] = None, expire_rate: float = 0.0,
+                 password: Optional[str] = None, two_factor: bool = False,
+                 blacklist_after: int = 5, seed: Optional[int] = None,
+                 max_concurrency: Optional[int] = None):
+        self.vm_count = vm_count
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.session_ttl = session_ttl
+        self.expire_rate = expire_rate
+        # None accepts any password
+        self.password = password
+        self.two_factor = two_factor
+        self.blacklist_after = blacklist_after
+        self.failed_logins = 0
+        # More concurrent _vm_remote.php requests than this get 429
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        # Session id -> login time
+        self.sessions: Dict[str, float] = {}
+        self.requests: Dict[str, int] = {}
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = QuietHTTPServer(('127.0.0.1', port), self._handler())
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def start(self) -> 'FakePanel':
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests.clear()
+
+    def count(self, path: str):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def total_requests(self) -> int:
+        with self._lock:
+            return sum(self.requests.values())
+
+    def delay(self):
+        time.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+    def fail(self) -> bool:
+        return self.random.random() < self.error_rate
+
+    def enter(self) -> bool:
+        """Admit a _vm_remote.php request, False if over max_concurrency."""
+        with self._lock:
+            if self.max_concurrency is not None and self.in_flight >= self.max_concurrency:
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def expire_sessions(self):
+        """Expire every session, forcing clients to log in again."""
+        with self._lock:
+            self.sessions.clear()
+
+    def session_valid(self, session_id: str) -> bool:
+        with self._lock:
+            logged_in_at = self.sessions.get(session_id)
+            if logged_in_at is None:
+                return False
+            expired = (
+                (self.session_ttl is not None and time.time() - logged_in_at > self.session_ttl)
+                or self.random.random() < self.expire_rate
+            )
+            if expired:
+                del self.sessions[session_id]
+            return not expired
+
+    def login(self, username: str, password: str) -> Dict:
+        with self._lock:
+            if self.failed_logins >= self.blacklist_after:
+                return {'success': True, 'status': '2'}
+            if self.password is not None and password != self.password:
+                self.failed_logins += 1
+                return {'success': True, 'status': '3'}
+            if self.two_factor:
+                return {'success': True, 'status': '4'}
+            self.failed_logins = 0
+            session_id = secrets.token_hex(16)
+            self.sessions[session_id] = time.time()
+            return {'success': True, 'status': '1', 'session_id': session_id}
+
+    def home_page(self) -> str:
+        rows = '\n'.join(
+            ROW_TEMPLATE.format(
+                vm_type='kvm' if i % 2 == 0 else 'openvz',
+                vm_id=f'vm{i:05d}',
+                hostname=f'racknerd-{i:05d}',
+                ip_address=f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}'
+            )
+            for i in range(self.vm_count)
+        )
+        return HOME_TEMPLATE.format(rows=rows)
+
+    def vm_stats(self, vm_id: str) -> Dict:
+        # Vary usage per VM, deterministically
+        n = sum(vm_id.encode()) % 100
+        return {
+            'success': '1',
+            'state': '0' if n % 10 == 0 else '1',
+            'totalbw': '1000 GB',
+            'usedbw': f'{n * 10.31:.2f} GB',
+            'percentbw': str(n),
+            'totalhdd': '40 GB',
+            'usedhdd': f'{n * 0.4:.2f} GB',
+            'percenthdd': str(n),
+            'totalmem': '2 GB',
+            'usedmem': f'{n * 20} MB',
+            'percentmem': str(n),
+            'totalvswap': 'null',
+            'usedvswap': 'null',
+            'percentvswap': '0',
+        }
+
+    def _handler(self):
+        panel = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: str = '', headers: Dict = None):
+                data = body.encode()
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _path(self) -> str:
+                return self.path.split('?')[0]
+
+            def _logged_in(self) -> bool:
+                for cookie in self.headers.get('Cookie', '').split(';'):
+                    name, _, value = cookie.strip().partition('=')
+                    if name == 'PHPSESSID' and panel.session_valid(value):
+                        return True
+                return False
+
+            def _form(self) -> Dict[str, str]:
+                length = int(self.headers.get('Content-Length', 0))
+                form = parse_qs(self.rfile.read(length).decode())
+                return {key: values[0] for key, values in form.items()}
+
+            def do_GET(self):
+                path = self._path()
+                panel.count(path)
+                panel.delay()
+                if path == '/home.php':
+                    if not self._logged_in():
+                        self._send(302, headers={'Location': '/login.php'})
+                    elif panel.fail():
+                        self._send(500, 'Internal Server Error')
+                    else:
+                        self._send(200, panel.home_page())
+                elif path == '/login.php':
+                    self._send(200, '<html><body><form id="login"></form></body></html>')
+                else:
+                    self._send(404)
+
+            def do_POST(self):
+                path = self._path()
+                panel.count(path)
+                form = self._form()
+                if path == '/_vm_remote.php':
+                    if not panel.enter():
+                        self._send(429, 'Too Many Requests', {'Retry-After': '1'})
+                        return
+                    try:
+                        panel.delay()
+                        self._vm_remote(form)
+                    finally:
+                        panel.leave()
+                    return
+
+                panel.delay()
+                if path == '/login.php':
+                    result = panel.login(form.get('username', ''), form.get('password', ''))
+                    session_id = result.pop('session_id', None)
+                    headers = {'Set-Cookie': f'PHPSESSID={session_id}; path=/'} if session_id else {}
+                    self._send(200, json.dumps(result), headers)
+                else:
+                    self._send(404)
+
+            def _vm_remote(self, form: Dict[str, str]):
+                if not self._logged_in():
+                    self._send(302, headers={'Location': '/login.php'})
+                elif panel.fail():
+                    self._send(500, 'Internal Server Error')
+                else:
+                    self._send(200, json.dumps(panel.vm_stats(form.get('vi', ''))))
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake RackNerd control panel')
+    parser.add_argument('--port', type=int, default=8080, help='Listen port (default: 8080)')
+    parser.add_argument('--vms', type=int, default=10, help='Number of VMs (default: 10)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every response (default: 0)')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Up to this many extra seconds per response (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Chance of a 500 from home.php and _vm_remote.php (default: 0)')
+    parser.add_argument('--session-ttl', type=float,
+                        help='Seconds after login until a session expires (default: never)')
+    parser.add_argument('--expire-rate', type=float, default=0.0,
+                        help='Chance that a request finds its session expired (default: 0)')
+    parser.add_argument('--password', help='Only accept this password (default: any)')
+    parser.add_argument('--two-factor', action='store_true',
+                        help='Answer logins with status 4 (2FA required)')
+    parser.add_argument('--blacklist-after', type=int, default=5,
+                        help='Failed logins before status 2 (blacklisted) (default: 5)')
+    parser.add_argument('--max-concurrency', type=int,
+                        help='Concurrent _vm_remote.php requests above which the panel '
+                             'answers 429 with Retry-After (default: unlimited)')
+    args = parser.parse_args()
+
+    panel = FakePanel(args.vms, args.latency, args.port, jitter=args.jitter,
+                      error_rate=args.error_rate, session_ttl=args.session_ttl,
+                      expire_rate=args.expire_rate, password=args.password,
+                      two_factor=args.two_factor, blacklist_after=args.blacklist_after,
+                      max_concurrency=args.max_concurrency)
+    print(f"Fake panel serving {args.vms} VMs on {panel.url}")
+    try:
+        panel.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,20 @@ if [ $# -eq 0 ]; then
         --username "${RACKNERD_USERNAME}" \
         --password "${RACKNERD_PASSWORD}" \
         --port "${RACKNERD_PORT:-9100}" \
+        --stats-concurrency "${RACKNERD_STATS_CONCURRENCY:-8}" \
+        --max-request-rate "${RACKNERD_MAX_REQUEST_RATE:-0}" \
+        --engine "${RACKNERD_ENGINE:-sync}" \
+        ${RACKNERD_SESSION_FILE:+--session-file "$RACKNERD_SESSION_FILE"} \
+        ${RACKNERD_SCHEDULE_FILE:+--schedule-file "$RACKNERD_SCHEDULE_FILE"} \
+        ${RACKNERD_CONFIG:+--config "$RACKNERD_CONFIG"} \
+        --refresh-interval "${RACKNERD_REFRESH_INTERVAL:-0}" \
+        --publish-interval "${RACKNERD_PUBLISH_INTERVAL:-15}" \
+        --inventory-ttl "${RACKNERD_INVENTORY_TTL:-3600}" \
+        --stats-ttl "${RACKNERD_STATS_TTL:-0}" \
+        --top-k "${RACKNERD_TOP_K:-0}" \
+        --vm-info-labels "${RACKNERD_VM_INFO_LABELS:-ip_address,os,vm_type}" \
+        --vm-label "${RACKNERD_VM_LABEL:-hostname}" \
+        --max-series "${RACKNERD_MAX_SERIES:-0}" \
         --log-level "${LOG_LEVEL:-INFO}"
 else
     # If arguments provided, use them directly
@@ -6,15 +6,45 @@ Exports metrics from RackNerd VPS control panel to Prometheus format.
 """
 
 import argparse
+import asyncio
+import gzip
+import hashlib
+import heapq
+import json
 import logging
+import math
+import os
+import signal
+import sys
+import threading
 import time
-from typing import Dict, List, Optional
+from array import array
+from email.utils import parsedate_to_datetime
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import lru_cache
+from socketserver import ThreadingMixIn
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
 import re
+from urllib.parse import parse_qs
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
 
 import requests
-from bs4 import BeautifulSoup
-from prometheus_client import start_http_server, Gauge, Info, Enum
-from prometheus_client.core import GaugeMetricFamily, REGISTRY, CounterMetricFamily
+import yaml
+from requests.adapters import HTTPAdapter
+import lxml.html
+try:
+    import aiohttp
+    import yarl
+except ImportError:  # Only required by the async engine
+    aiohttp = None
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest, make_wsgi_app
+from prometheus_client.exposition import choose_encoder, gzip_accepted
+from prometheus_client.core import (
+    GaugeMetricFamily, REGISTRY, CounterMetricFamily, HistogramMetricFamily, Metric
+)
+from prometheus_client.samples import Sample
 
 
 logging.basicConfig(
@@ -23,438 +53,2976 @@ logging.basicConfig(
 )
 logger = logging.getLogger('racknerd_exporter')
 
+# Per-thread state of the scrape being served, see ScrapeMiddleware
+_scrape = threading.local()
+
+
+def scrape_deadline() -> Optional[float]:
+    """Return the deadline (epoch seconds) of the scrape served on this thread."""
+    return getattr(_scrape, 'deadline', None)
+
+
+def check_login_response(json_response: Dict) -> bool:
+    """Check the JSON body returned by login.php, logging why it failed."""
+    logger.debug(f"Login JSON response: {json_response}")
+
+    if not json_response.get('success'):
+        logger.error("Login failed - success=false in response")
+        return False
+
+    status = json_response.get('status')
+    if status == "1":
+        logger.info("Successfully logged in to RackNerd")
+        return True
+    elif status == "4":
+        logger.error("2FA is enabled - not currently supported")
+    elif status == "2":
+        logger.error("Account blacklisted due to multiple failed login attempts")
+    elif status == "3":
+        logger.error("Invalid username or password")
+    else:
+        logger.error(f"Unknown login status: {status}")
+    return False
+
+
+def verify_login_page(html: str) -> bool:
+    """Check the home page fetched right after login shows a session."""
+    if 'logout.php' in html:
+        logger.info("Login verified successfully")
+        return True
+    logger.error("Login succeeded but verification failed")
+    logger.debug(f"Verification page preview: {html[:500]}")
+    return False
+
+
+# Start of the VM table and of any table nested inside it
+VMLIST_START_RE = re.compile(r'<table\b[^>]*\bid\s*=\s*["\']?vmlist\b', re.IGNORECASE)
+TABLE_TAG_RE = re.compile(r'<(/?)table\b', re.IGNORECASE)
+VM_ID_RE = re.compile(r'\?_v=([^&]+)')
+
+
+def extract_vmlist_table(html: str) -> Optional[str]:
+    """Cut the markup of the vmlist table out of the home page.
+
+    Tracks nested tables so the matching closing tag is found. Returns None
+    if the table is missing or unterminated.
+    """
+    match = VMLIST_START_RE.search(html)
+    if not match:
+        return None
+
+    depth = 0
+    for tag in TABLE_TAG_RE.finditer(html, match.start()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            return html[match.start():html.index('>', tag.end()) + 1]
+    return None
+
+
+def parse_vm_list(html: str) -> List[Dict]:
+    """Parse the VM list from the home page.
+
+    Only the vmlist table is handed to lxml, so no tree is built for the
+    rest of the page.
+    """
+    fragment = extract_vmlist_table(html)
+    if fragment is None:
+        logger.warning("VM table not found on home page")
+        logger.debug(f"Page content preview: {html[:1000]}")
+        return []
+
+    table = lxml.html.fragment_fromstring(fragment)
+    tbody = table.find('.//tbody')
+    if tbody is None:
+        return []
+
+    vms = []
+    for row in tbody.iter('tr'):
+        cells = row.findall('.//td')
+        if len(cells) < 6:
+            continue
+
+        # Extract VM ID from control.php link
+        link = cells[1].find('.//a')
+        if link is None:
+            continue
+
+        vm_id_match = VM_ID_RE.search(link.get('href', ''))
+        if not vm_id_match:
+            continue
+
+        # Extract other details
+        vm_type = 'kvm' if any('kvm.png' in value for value in cells[0].xpath('.//@*')) else 'openvz'
+
+        vms.append({
+            'vm_id': vm_id_match.group(1),
+            'hostname': link.text_content().strip(),
+            'vm_type': vm_type,
+            'ip_address': cells[2].text_content().strip(),
+            'os': cells[3].text_content().strip(),
+            'memory': cells[4].text_content().strip(),
+            'disk': cells[5].text_content().strip()
+        })
 
-class RackNerdClient:
-    """Client to interact with RackNerd control panel."""
+    logger.info(f"Found {len(vms)} VMs")
+    return vms
+
+
+def save_json(path: str, data):
+    """Atomically write data as JSON to a file readable only by us."""
+    tmp_path = f'{path}.tmp'
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def load_json(path: str, default):
+    """Read data saved by save_json, or default if there is none."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable file {path}: {e}")
+        return default
+
+
+def request_outcome(status: int, redirected_to_login: bool) -> str:
+    """Classify a panel response for the request metrics."""
+    if redirected_to_login:
+        return 'expired'
+    if status >= 400:
+        return 'http_error'
+    return 'success'
+
+
+class PanelMetrics:
+    """Thread-safe record of the exporter's own work against the panel.
+
+    Request latency histograms are kept per (endpoint, outcome). Stage
+    durations hold the time of the last run of each stage of a refresh.
+    """
+
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    STAGES = ('login_check', 'vm_list_fetch', 'vm_list_parse', 'stats_fetch', 'serialize')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (endpoint, outcome) -> [per-bucket counts (last is +Inf), sum]
+        self.latency: Dict[Tuple[str, str], list] = {}
+        self.bytes_received: Dict[str, int] = {}
+        self.logins = 0
+        self.relogins = 0
+        self.stages: Dict[str, float] = {}
+
+    def observe_request(self, endpoint: str, outcome: str, duration: float, size: int):
+        bucket = bisect_left(self.LATENCY_BUCKETS, duration)
+        with self._lock:
+            histogram = self.latency.get((endpoint, outcome))
+            if histogram is None:
+                histogram = self.latency[(endpoint, outcome)] = [
+                    [0] * (len(self.LATENCY_BUCKETS) + 1), 0.0
+                ]
+            histogram[0][bucket] += 1
+            histogram[1] += duration
+            self.bytes_received[endpoint] = self.bytes_received.get(endpoint, 0) + size
+
+    def observe_stage(self, stage: str, duration: float):
+        self.stages[stage] = duration
+
+    def count_login(self, relogin: bool = False):
+        with self._lock:
+            self.logins += 1
+            if relogin:
+                self.relogins += 1
+
+    def histograms(self) -> List[Tuple[str, str, List[Tuple[str, int]], int, float]]:
+        """Return (endpoint, outcome, cumulative buckets, count, sum) tuples."""
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self.latency.items()]
+
+        result = []
+        for (endpoint, outcome), counts, total in sorted(items):
+            buckets = []
+            cumulative = 0
+            for bound, count in zip(self.LATENCY_BUCKETS + (float('inf'),), counts):
+                cumulative += count
+                buckets.append(('+Inf' if bound == float('inf') else str(bound), cumulative))
+            result.append((endpoint, outcome, buckets, cumulative, total))
+        return result
+
+
+class LoginBackoff:
+    """Exponential backoff between failed logins.
+
+    Repeated failed logins get the account blacklisted by the panel, so
+    after each failure further attempts are refused for a growing delay.
+    """
+
+    def __init__(self, base: float = 30.0, maximum: float = 3600.0):
+        self.base = base
+        self.maximum = maximum
+        self.failures = 0
+        self.next_attempt = 0.0
+
+    def remaining(self) -> float:
+        """Seconds until the next login attempt is allowed."""
+        return max(0.0, self.next_attempt - time.time())
+
+    def allowed(self) -> bool:
+        if self.remaining() > 0:
+            logger.warning(f"Login backing off for {self.remaining():.0f}s "
+                           f"after {self.failures} failed attempts")
+            return False
+        return True
+
+    def record(self, success: bool):
+        """Record the outcome of a login attempt."""
+        if success:
+            self.failures = 0
+            self.next_attempt = 0.0
+        else:
+            self.failures += 1
+            self.next_attempt = time.time() + min(self.maximum, self.base * 2 ** (self.failures - 1))
+
+
+# Longest pause honoured from a Retry-After header
+MAX_RETRY_AFTER = 600.0
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (seconds or HTTP date) into seconds."""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(MAX_RETRY_AFTER, max(0.0, seconds))
+
+
+def throttle_reason(status: Optional[int], retry_after: Optional[float] = None,
+                    error: Optional[BaseException] = None) -> Optional[str]:
+    """Return why a panel response calls for backing off, or None if healthy."""
+    if error is not None:
+        if isinstance(error, (requests.Timeout, asyncio.TimeoutError)):
+            return 'timeout'
+        return 'error'
+    if status == 429:
+        return 'rate_limited'
+    if status >= 500:
+        return 'server_error'
+    if retry_after is not None:
+        return 'retry_after'
+    return None
+
+
+class TokenBucket:
+    """Caps the rate of panel requests, shared by every client."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.time()
+        # Requests that had to wait for a token
+        self.delayed = 0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token, returning how many seconds to wait before using it."""
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            self.delayed += 1
+            return -self.tokens / self.rate
+
+
+class AdaptiveLimiter:
+    """AIMD limit on the number of panel requests in flight.
+
+    Every healthy response faster than latency_target adds 1/limit to the
+    limit, so it grows by about one per round of requests. A timeout,
+    error, 5xx or 429 halves it, at most once per round. A Retry-After
+    header pauses new requests for that long.
+    """
+
+    def __init__(self, maximum: int, minimum: int = 1, latency_target: float = 2.0):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.latency_target = latency_target
+        self.limit = float(max(self.minimum, self.maximum // 2))
+        self.in_flight = 0
+        self.paused_until = 0.0
+        # Reason -> number of responses that made the limiter back off
+        self.throttles: Dict[str, int] = {}
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def pause_remaining(self) -> float:
+        return max(0.0, self.paused_until - time.time())
+
+    def _wait_time(self) -> Optional[float]:
+        """Seconds until a request may start: 0 now, None once one finishes."""
+        pause = self.pause_remaining()
+        if pause > 0:
+            return pause
+        if self.in_flight >= int(self.limit):
+            return None
+        return 0.0
+
+    def _record(self, started: float, duration: float, reason: Optional[str],
+                retry_after: Optional[float]):
+        if retry_after:
+            self.paused_until = max(self.paused_until, time.time() + retry_after)
+        if reason is None:
+            if duration <= self.latency_target:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            return
+
+        self.throttles[reason] = self.throttles.get(reason, 0) + 1
+        # Requests started before the last decrease report the same congestion
+        if started >= self._last_decrease:
+            self.limit = max(self.minimum, self.limit / 2)
+            self._last_decrease = time.time()
+            logger.info(f"Panel throttling ({reason}), concurrency limit now {int(self.limit)}")
+
+    def acquire(self):
+        """Wait until another request may be sent."""
+        with self._cond:
+            while True:
+                wait = self._wait_time()
+                if wait == 0:
+                    break
+                self._cond.wait(wait)
+            self.in_flight += 1
+
+    def release(self, started: float, duration: float, reason: Optional[str] = None,
+                retry_after: Optional[float] = None):
+        """Record the outcome of a request acquired with acquire()."""
+        with self._cond:
+            self.in_flight -= 1
+            self._record(started, duration, reason, retry_after)
+            self._cond.notify_all()
+
+
+class AsyncAdaptiveLimiter(AdaptiveLimiter):
+    """AdaptiveLimiter for requests made on one asyncio event loop."""
+
+    def __init__(self, maximum: int, minimum: int = 1, latency_target: float = 2.0):
+        super().__init__(maximum, minimum, latency_target)
+        self._waiters: List[asyncio.Future] = []
+
+    def _wake(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    async def acquire(self):
+        while True:
+            wait = self._wait_time()
+            if wait == 0:
+                break
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, wait)
+            except asyncio.TimeoutError:
+                pass
+        self.in_flight += 1
+
+    def release(self, started: float, duration: float, reason: Optional[str] = None,
+                retry_after: Optional[float] = None):
+        self.in_flight -= 1
+        self._record(started, duration, reason, retry_after)
+        self._wake()
+
+    def abandon(self):
+        """Release a request that was cancelled, without judging the panel by it."""
+        self.in_flight -= 1
+        self._wake()
+
+
+class CircuitOpen(Exception):
+    """Raised instead of sending a request to an endpoint whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Stops sending requests to a failing panel endpoint.
+
+    After failure_threshold consecutive failures (errors or 5xx) the
+    circuit opens and requests fail fast. Once reset_timeout has passed a
+    single probe request is let through (half-open): success closes the
+    circuit, failure opens it again for twice as long, up to
+    max_reset_timeout.
+    """
+
+    STATES = ('closed', 'half_open', 'open')
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 max_reset_timeout: float = 600.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max(reset_timeout, max_reset_timeout)
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.timeout = reset_timeout
+        # Requests refused while the circuit was open
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now."""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.time() - self.opened_at >= self.timeout:
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
 
-    def __init__(self, base_url: str, username: str, password: str):
+    def record(self, success: bool):
+        """Record the outcome of a request let through by allow()."""
+        with self._lock:
+            if success:
+                if self.state != 'closed':
+                    logger.info("Panel recovered, circuit closed")
+                self.state = 'closed'
+                self.failures = 0
+                self.timeout = self.reset_timeout
+                self._probing = False
+                return
+
+            self.failures += 1
+            if self.state == 'half_open':
+                self.timeout = min(self.max_reset_timeout, self.timeout * 2)
+                self._open()
+            elif self.state == 'closed' and self.failures >= self.failure_threshold:
+                self._open()
+
+    def cancel(self):
+        """Forget a request let through by allow() that was never completed."""
+        with self._lock:
+            self._probing = False
+
+    def _open(self):
+        self.state = 'open'
+        self.opened_at = time.time()
+        self._probing = False
+        logger.warning(f"Panel failing, circuit open for {self.timeout:.0f}s "
+                       f"after {self.failures} failures")
+
+
+class BaseRackNerdClient:
+    """State and decisions shared by the sync and async panel clients.
+
+    Holds the circuit breakers, login generations and backoff, and the
+    rules for reading panel responses. Subclasses do the I/O: they set
+    limiter and implement request, login and save_session.
+    """
+
+    def __init__(self, base_url: str, username: str, password: str,
+                 timeout: Tuple[float, float] = (5.0, 30.0), session_file: Optional[str] = None,
+                 rate_limiter: Optional[TokenBucket] = None, circuit: Tuple[int, float] = (5, 30.0)):
         self.base_url = base_url.rstrip('/')
         self.username = username
         self.password = password
+        # (connect, read) timeout applied to every request
+        self.timeout = timeout
+        # Cookies are saved here after login and restored at startup
+        self.session_file = session_file
+        # Shared cap on requests per second, if any
+        self.rate_limiter = rate_limiter
+        # (failure threshold, reset timeout) of the circuit breakers
+        self.circuit = circuit
+        # Endpoint -> circuit breaker
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._logged_in = False
+        # Incremented on every successful login, see relogin()
+        self._login_generation = 0
+        self.backoff = LoginBackoff()
+        self.metrics = PanelMetrics()
+        # Number of home.php validation probes skipped by trusting the session
+        self.probes_avoided = 0
+        # VM ID -> when its stats calls started failing in a fresh session too
+        self.failing_vms: Dict[str, float] = {}
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        """Return the circuit breaker of a panel endpoint."""
+        if endpoint not in self.breakers:
+            self.breakers[endpoint] = CircuitBreaker(*self.circuit)
+        return self.breakers[endpoint]
+
+    def record_response(self, endpoint: str, breaker: CircuitBreaker, start: float, status: int,
+                        retry_after: Optional[float], redirected_to_login: bool, size: int):
+        """Feed a panel response to the breaker, the limiter and the metrics."""
+        breaker.record(status < 500)
+        self.limiter.release(start, time.time() - start,
+                             throttle_reason(status, retry_after), retry_after)
+        outcome = request_outcome(status, redirected_to_login)
+        self.metrics.observe_request(endpoint, outcome, time.time() - start, size)
+
+    def record_error(self, endpoint: str, breaker: CircuitBreaker, start: float, error: Exception):
+        """Feed a request that got no response to the breaker, the limiter and the metrics."""
+        self.limiter.release(start, time.time() - start, throttle_reason(None, error=error))
+        breaker.record(False)
+        self.metrics.observe_request(endpoint, 'error', time.time() - start, 0)
+
+    def trust_session(self) -> bool:
+        """Whether an established session can be used without a login.
+
+        An established session is trusted until a panel response shows that
+        it has expired (see relogin), so no probe is made.
+        """
+        if self._logged_in:
+            self.probes_avoided += 1
+            return True
+        logger.info("Not logged in, attempting login...")
+        return False
+
+    def expire_session(self, generation: int, reason: str):
+        """Mark the session expired, unless a login has happened since generation."""
+        if self._login_generation == generation:
+            logger.info(f"Session expired ({reason})")
+            self._logged_in = False
+
+    def logged_in_since(self, generation: Optional[int]) -> bool:
+        """Whether another caller has completed a login since generation."""
+        return generation is not None and self._logged_in and self._login_generation != generation
+
+    def finish_login(self, success: bool) -> bool:
+        """Record the outcome of a login attempt."""
+        self.backoff.record(success)
+        if success:
+            self._login_generation += 1
+            self.save_session()
+        return success
+
+    def login_form(self) -> Dict[str, str]:
+        """Form posted to login.php.
+
+        The login page uses AJAX with JSON responses; its login function
+        posts with act: "login" and Submit: "1".
+        """
+        return {
+            'act': 'login',
+            'Submit': '1',
+            'username': self.username,
+            'password': self.password,
+        }
+
+    def accept_login(self, text: str) -> bool:
+        """Check the JSON response to a login, marking the session logged in."""
+        try:
+            json_response = json.loads(text)
+        except ValueError as e:
+            logger.error(f"Failed to parse login response as JSON: {e}")
+            logger.debug(f"Response content: {text}")
+            return False
+
+        if not check_login_response(json_response):
+            return False
+        self._logged_in = True
+        return True
+
+    @staticmethod
+    def vm_list_expired(redirected_to_login: bool, text: str) -> bool:
+        """Whether a home.php response shows the session has expired."""
+        if redirected_to_login or 'logout.php' not in text:
+            logger.warning("Not logged in - logout link not found on page")
+            logger.debug(f"Page content preview: {text[:500]}")
+            return True
+        return False
+
+    def read_vm_stats(self, vm_id: str, redirected_to_login: bool, text: str) -> Optional[Dict]:
+        """Return the stats in a _vm_remote.php response, None if it failed."""
+        try:
+            data = None if redirected_to_login else json.loads(text)
+        except ValueError:
+            data = None
+
+        if data and data.get('success') == '1':
+            self.failing_vms.pop(vm_id, None)
+            return data
+        return None
+
+    def stats_failure_expired(self, vm_id: str, redirected_to_login: bool) -> bool:
+        """Whether a failed stats call is a sign of an expired session.
+
+        A VM that also fails in a fresh session (e.g. a suspended one) is no
+        sign of expiry until it succeeds again.
+        """
+        return redirected_to_login or vm_id not in self.failing_vms
+
+    def mark_failing(self, vm_id: str):
+        """Mark a VM whose stats failed again after logging in."""
+        if vm_id not in self.failing_vms:
+            logger.warning(f"Failed to get stats for VM {vm_id}, also after logging in again")
+            self.failing_vms[vm_id] = time.time()
+
+    @staticmethod
+    def log_fetch_error(what: str, error: Exception):
+        """Log a failed fetch; an open circuit is expected and only debug."""
+        if isinstance(error, CircuitOpen):
+            logger.debug(f"Not fetching {what}: {error}")
+        else:
+            logger.error(f"Error getting {what}: {error}")
+
+
+class RackNerdClient(BaseRackNerdClient):
+    """Client to interact with RackNerd control panel."""
+
+    def __init__(self, base_url: str, username: str, password: str, pool_size: int = 10,
+                 timeout: Tuple[float, float] = (5.0, 30.0), session_file: Optional[str] = None,
+                 latency_target: float = 2.0, rate_limiter: Optional[TokenBucket] = None,
+                 circuit: Tuple[int, float] = (5, 30.0)):
+        super().__init__(base_url, username, password, timeout, session_file, rate_limiter, circuit)
         self.session = requests.Session()
+        # Keep one pooled connection per concurrent stats worker
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.session.headers.update({
             'User-Agent': 'RackNerd-Prometheus-Exporter/1.0'
         })
-        self._logged_in = False
-
-    def is_logged_in(self) -> bool:
-        """Check if user is currently logged in by testing access to home page."""
+        # Adapts the requests in flight to how the panel copes, up to pool_size
+        self.limiter = AdaptiveLimiter(pool_size, latency_target=latency_target)
+        self._login_lock = threading.Lock()
+
+    def request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+        """Make a request to a panel endpoint, retrying once if rate limited."""
+        response = self.send(method, endpoint, **kwargs)
+        if response.status_code == 429:
+            # The limiter holds this until any Retry-After has passed
+            response = self.send(method, endpoint, **kwargs)
+        return response
+
+    def send(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+        """Make one request to a panel endpoint, recording it in the metrics.
+
+        Waits for the adaptive concurrency limit and the shared rate limit.
+        Raises CircuitOpen without sending while the endpoint is failing.
+        """
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            raise CircuitOpen(f"circuit open for {endpoint}")
+        self.limiter.acquire()
+        if self.rate_limiter is not None:
+            time.sleep(self.rate_limiter.reserve())
+        start = time.time()
         try:
-            response = self.session.get(f'{self.base_url}/home.php')
-            if response.status_code == 200:
-                # Check if we're actually logged in or redirected to login page
-                if 'logout.php' in response.text and 'vmlist' in response.text:
-                    logger.debug("Session is valid")
-                    return True
-                else:
-                    logger.debug("Session invalid - not logged in")
-                    return False
-            return False
+            response = self.session.request(
+                method, f'{self.base_url}/{endpoint}', timeout=self.timeout, **kwargs
+            )
         except Exception as e:
-            logger.debug(f"Session check failed: {e}")
-            return False
+            self.record_error(endpoint, breaker, start, e)
+            raise
+        self.record_response(endpoint, breaker, start, response.status_code,
+                             parse_retry_after(response.headers.get('Retry-After')),
+                             self.is_login_redirect(response), len(response.content))
+        return response
 
     def ensure_logged_in(self) -> bool:
-        """Ensure user is logged in, re-login if necessary."""
-        if self._logged_in and self.is_logged_in():
-            return True
+        """Ensure user is logged in, login if necessary."""
+        generation = self._login_generation
+        return self.trust_session() or self.login(generation)
+
+    def relogin(self, generation: int, reason: str) -> bool:
+        """Login again after a call made in the given login generation failed.
+
+        If another caller has logged in since, its session is reused.
+        """
+        with self._login_lock:
+            self.expire_session(generation, reason)
+        return self.login(generation, relogin=True)
+
+    @staticmethod
+    def is_login_redirect(response: requests.Response) -> bool:
+        """Check if a response was redirected to the login page."""
+        return bool(response.history) and 'login.php' in response.url
+
+    def login(self, generation: Optional[int] = None, relogin: bool = False) -> bool:
+        """Login to RackNerd control panel.
+
+        Only one login runs at a time. Callers passing the login generation
+        they last saw skip the login if another caller completed one since.
+        """
+        with self._login_lock:
+            if self.logged_in_since(generation):
+                return True
+            if not self.backoff.allowed():
+                return False
 
-        logger.info("Session expired or not logged in, attempting login...")
-        self._logged_in = False
-        return self.login()
+            self.metrics.count_login(relogin)
+            return self.finish_login(self._login())
 
-    def login(self) -> bool:
-        """Login to RackNerd control panel."""
+    def save_session(self):
+        """Save the session cookies to the session file, if configured."""
+        if not self.session_file:
+            return
         try:
-            # The login page uses AJAX with JSON responses
-            # The login function posts with act: "login" and Submit: "1"
-            login_data = {
-                'act': 'login',
-                'Submit': '1',
-                'username': self.username,
-                'password': self.password,
-            }
+            save_json(self.session_file, [
+                {'name': c.name, 'value': c.value, 'domain': c.domain,
+                 'path': c.path, 'secure': c.secure, 'expires': c.expires}
+                for c in self.session.cookies
+            ])
+        except OSError as e:
+            logger.warning(f"Failed to save session to {self.session_file}: {e}")
+
+    def load_session(self) -> bool:
+        """Restore cookies from the session file.
+
+        The restored session is trusted like a fresh login and only checked
+        by the first panel response, which logs in again if it expired.
+        """
+        if not self.session_file:
+            return False
+        cookies = load_json(self.session_file, [])
+        for cookie in cookies:
+            self.session.cookies.set(
+                cookie['name'], cookie['value'], domain=cookie.get('domain', ''),
+                path=cookie.get('path', '/'), secure=cookie.get('secure', False),
+                expires=cookie.get('expires')
+            )
+        self._logged_in = bool(cookies)
+        return self._logged_in
 
+    def _login(self) -> bool:
+        try:
             logger.debug(f"Attempting login for user: {self.username}")
 
             # Perform login via AJAX endpoint
-            response = self.session.post(
-                f'{self.base_url}/login.php',
-                data=login_data,
-            )
+            response = self.request('POST', 'login.php', data=self.login_form())
             response.raise_for_status()
 
             logger.debug(f"Login response status: {response.status_code}")
             logger.debug(f"Login response text: {response.text[:500]}")
             logger.debug(f"Cookies after login: {self.session.cookies.get_dict()}")
 
-            # Parse JSON response
-            try:
-                json_response = response.json()
-                logger.debug(f"Login JSON response: {json_response}")
-
-                if json_response.get('success'):
-                    status = json_response.get('status')
-                    if status == "1":
-                        # Login successful
-                        self._logged_in = True
-                        logger.info("Successfully logged in to RackNerd")
-                        logger.debug(f"Session cookies: {self.session.cookies.get_dict()}")
-
-                        # Verify login by checking home page
-                        verify = self.session.get(f'{self.base_url}/home.php')
-                        if 'logout.php' in verify.text:
-                            logger.info("Login verified successfully")
-                            return True
-                        else:
-                            logger.error("Login succeeded but verification failed")
-                            logger.debug(f"Verification page preview: {verify.text[:500]}")
-                            return False
-                    elif status == "4":
-                        logger.error("2FA is enabled - not currently supported")
-                        return False
-                    elif status == "2":
-                        logger.error("Account blacklisted due to multiple failed login attempts")
-                        return False
-                    elif status == "3":
-                        logger.error("Invalid username or password")
-                        return False
-                    else:
-                        logger.error(f"Unknown login status: {status}")
-                        return False
-                else:
-                    logger.error("Login failed - success=false in response")
-                    return False
-
-            except ValueError as e:
-                logger.error(f"Failed to parse login response as JSON: {e}")
-                logger.debug(f"Response content: {response.text}")
+            if not self.accept_login(response.text):
                 return False
 
+            # Verify login by checking home page
+            verify = self.request('GET', 'home.php')
+            return verify_login_page(verify.text)
+
         except Exception as e:
             logger.error(f"Login error: {e}")
             return False
 
-    def get_vms(self) -> List[Dict]:
-        """Get list of VMs from home page."""
+    def get_vms(self, retry: bool = True) -> List[Dict]:
+        """Get list of VMs from home page.
+
+        If the page shows the session has expired, login once and replay.
+        """
+        start = time.time()
         if not self.ensure_logged_in():
             return []
+        self.metrics.observe_stage('login_check', time.time() - start)
+        generation = self._login_generation
 
         try:
-            response = self.session.get(f'{self.base_url}/home.php')
+            start = time.time()
+            response = self.request('GET', 'home.php')
             response.raise_for_status()
+            text = response.text
+            self.metrics.observe_stage('vm_list_fetch', time.time() - start)
 
             logger.debug(f"Home page response status: {response.status_code}")
 
-            soup = BeautifulSoup(response.text, 'html.parser')
-            vms = []
-
-            # Check if we're actually logged in
-            if 'logout.php' not in response.text:
-                logger.warning("Not logged in - logout link not found on page")
-                logger.debug(f"Page content preview: {response.text[:500]}")
-                # Try to re-login
-                self._logged_in = False
-                if self.ensure_logged_in():
-                    return self.get_vms()  # Retry
+            if self.vm_list_expired(self.is_login_redirect(response), text):
+                if retry and self.relogin(generation, "home.php without logout link"):
+                    return self.get_vms(retry=False)
                 return []
 
-            # Find the VM table
-            table = soup.find('table', {'id': 'vmlist'})
-            if not table:
-                logger.warning("VM table not found on home page")
-                logger.debug(f"Page title: {soup.title.string if soup.title else 'No title'}")
-                logger.debug(f"Page content preview: {response.text[:1000]}")
-                return []
+            start = time.time()
+            vms = parse_vm_list(text)
+            self.metrics.observe_stage('vm_list_parse', time.time() - start)
+            return vms
 
-            tbody = table.find('tbody')
-            if not tbody:
-                return []
+        except Exception as e:
+            self.log_fetch_error("VMs", e)
+            return []
 
-            for row in tbody.find_all('tr'):
-                cells = row.find_all('td')
-                if len(cells) < 6:
-                    continue
+    def get_vm_stats(self, vm_id: str, retry: bool = True) -> Optional[Dict]:
+        """Get detailed stats for a specific VM.
 
-                # Extract VM ID from control.php link
-                link = cells[1].find('a')
-                if not link:
-                    continue
+        A redirect to login, a non-JSON body or a non-success JSON body is
+        treated as an expired session: login once and replay the call. If
+        the replay fails too, the VM is marked failing, and until it next
+        succeeds only a redirect to login counts as expiry.
+        """
+        if not self.ensure_logged_in():
+            return None
+        generation = self._login_generation
 
-                href = link.get('href', '')
-                vm_id_match = re.search(r'\?_v=([^&]+)', href)
-                if not vm_id_match:
-                    continue
+        try:
+            # Get VM stats via AJAX endpoint
+            response = self.request('POST', '_vm_remote.php', data={
+                'act': 'getstatsdiskusage',
+                'vi': vm_id
+            })
+            response.raise_for_status()
+
+            redirected = self.is_login_redirect(response)
+            data = self.read_vm_stats(vm_id, redirected, response.text)
+            if data is not None:
+                return data
+
+            if retry and self.stats_failure_expired(vm_id, redirected):
+                if self.relogin(generation, f"no stats returned for VM {vm_id}"):
+                    return self.get_vm_stats(vm_id, retry=False)
+                return None
+
+            self.mark_failing(vm_id)
+            return None
+
+        except Exception as e:
+            self.log_fetch_error(f"stats for VM {vm_id}", e)
+            return None
+
+
+class PanelResponse(NamedTuple):
+    """Fully read response from AsyncRackNerdClient.request."""
+
+    status: int
+    text: str
+    redirected_to_login: bool
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise RuntimeError(f"HTTP {self.status} from panel")
+
+
+class AsyncRackNerdClient(BaseRackNerdClient):
+    """Asyncio client to interact with RackNerd control panel.
+
+    Offers the same calls as RackNerdClient as coroutines on a pooled
+    aiohttp session, so many requests can be in flight on one thread.
+    """
+
+    def __init__(self, base_url: str, username: str, password: str, pool_size: int = 100,
+                 timeout: Tuple[float, float] = (5.0, 30.0), session_file: Optional[str] = None,
+                 latency_target: float = 2.0, rate_limiter: Optional[TokenBucket] = None,
+                 circuit: Tuple[int, float] = (5, 30.0)):
+        if aiohttp is None:
+            raise RuntimeError("The async engine requires the aiohttp package")
+        super().__init__(base_url, username, password, timeout, session_file, rate_limiter, circuit)
+        self.pool_size = pool_size
+        # Created on first use so it binds to the running event loop
+        self._session: Optional['aiohttp.ClientSession'] = None
+        # Adapts the requests in flight to how the panel copes, up to pool_size
+        self.limiter = AsyncAdaptiveLimiter(pool_size, latency_target=latency_target)
+        # Created on first use so it binds to the running event loop
+        self._login_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def session(self) -> 'aiohttp.ClientSession':
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                # Allow cookies for panels addressed by IP
+                cookie_jar=aiohttp.CookieJar(unsafe=True),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.timeout[0],
+                                              sock_read=self.timeout[1]),
+                headers={'User-Agent': 'RackNerd-Prometheus-Exporter/1.0'}
+            )
+        return self._session
+
+    async def close(self):
+        """Close the underlying HTTP session."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def request(self, method: str, endpoint: str, **kwargs) -> PanelResponse:
+        """Make a request to a panel endpoint, retrying once if rate limited."""
+        response = await self.send(method, endpoint, **kwargs)
+        if response.status == 429:
+            # The limiter holds this until any Retry-After has passed
+            response = await self.send(method, endpoint, **kwargs)
+        return response
+
+    async def send(self, method: str, endpoint: str, **kwargs) -> PanelResponse:
+        """Make one request to a panel endpoint, recording it in the metrics.
+
+        Waits for the adaptive concurrency limit and the shared rate limit.
+        Raises CircuitOpen without sending while the endpoint is failing.
+        """
+        breaker = self.breaker(endpoint)
+        if not breaker.allow():
+            raise CircuitOpen(f"circuit open for {endpoint}")
+        try:
+            await self.limiter.acquire()
+        except asyncio.CancelledError:
+            breaker.cancel()
+            raise
+        start = time.time()
+        try:
+            if self.rate_limiter is not None:
+                await asyncio.sleep(self.rate_limiter.reserve())
+                start = time.time()
+            async with self.session.request(method, f'{self.base_url}/{endpoint}', **kwargs) as response:
+                body = await response.read()
+                result = PanelResponse(response.status, await response.text(),
+                                       self.is_login_redirect(response))
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        except asyncio.CancelledError:
+            self.limiter.abandon()
+            breaker.cancel()
+            raise
+        except Exception as e:
+            self.record_error(endpoint, breaker, start, e)
+            raise
+        self.record_response(endpoint, breaker, start, result.status, retry_after,
+                             result.redirected_to_login, len(body))
+        return result
+
+    @property
+    def login_lock(self) -> asyncio.Lock:
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        return self._login_lock
+
+    async def ensure_logged_in(self) -> bool:
+        """Ensure user is logged in, login if necessary."""
+        generation = self._login_generation
+        return self.trust_session() or await self.login(generation)
+
+    async def relogin(self, generation: int, reason: str) -> bool:
+        """Login again after a call made in the given login generation failed.
+
+        If another caller has logged in since, its session is reused.
+        """
+        self.expire_session(generation, reason)
+        return await self.login(generation, relogin=True)
+
+    @staticmethod
+    def is_login_redirect(response: 'aiohttp.ClientResponse') -> bool:
+        """Check if a response was redirected to the login page."""
+        return bool(response.history) and 'login.php' in str(response.url)
+
+    async def login(self, generation: Optional[int] = None, relogin: bool = False) -> bool:
+        """Login to RackNerd control panel, see RackNerdClient.login."""
+        async with self.login_lock:
+            if self.logged_in_since(generation):
+                return True
+            if not self.backoff.allowed():
+                return False
+
+            self.metrics.count_login(relogin)
+            return self.finish_login(await self._login())
+
+    def save_session(self):
+        """Save the session cookies to the session file, if configured."""
+        if not self.session_file:
+            return
+        try:
+            save_json(self.session_file, [
+                {'name': morsel.key, 'value': morsel.value, 'domain': morsel['domain'],
+                 'path': morsel['path'] or '/'}
+                for morsel in self.session.cookie_jar
+            ])
+        except OSError as e:
+            logger.warning(f"Failed to save session to {self.session_file}: {e}")
+
+    async def load_session(self) -> bool:
+        """Restore cookies from the session file, see RackNerdClient.load_session."""
+        if not self.session_file:
+            return False
+        cookies = load_json(self.session_file, [])
+        for cookie in cookies:
+            self.session.cookie_jar.update_cookies(
+                {cookie['name']: cookie['value']}, response_url=yarl.URL(self.base_url)
+            )
+        self._logged_in = bool(cookies)
+        return self._logged_in
+
+    async def _login(self) -> bool:
+        try:
+            logger.debug(f"Attempting login for user: {self.username}")
+
+            response = await self.request('POST', 'login.php', data=self.login_form())
+            response.raise_for_status()
+
+            if not self.accept_login(response.text):
+                return False
+
+            # Verify login by checking home page
+            verify = await self.request('GET', 'home.php')
+            return verify_login_page(verify.text)
+
+        except Exception as e:
+            logger.error(f"Login error: {e}")
+            return False
+
+    async def get_vms(self, retry: bool = True) -> List[Dict]:
+        """Get list of VMs from home page, see RackNerdClient.get_vms."""
+        start = time.time()
+        if not await self.ensure_logged_in():
+            return []
+        self.metrics.observe_stage('login_check', time.time() - start)
+        generation = self._login_generation
+
+        try:
+            start = time.time()
+            response = await self.request('GET', 'home.php')
+            response.raise_for_status()
+            text = response.text
+            self.metrics.observe_stage('vm_list_fetch', time.time() - start)
 
-                vm_id = vm_id_match.group(1)
-                hostname = link.text.strip()
-
-                # Extract other details
-                vm_type = 'kvm' if 'kvm.png' in str(cells[0]) else 'openvz'
-                ip_address = cells[2].text.strip()
-                os = cells[3].text.strip()
-                memory = cells[4].text.strip()
-                disk = cells[5].text.strip()
-
-                vms.append({
-                    'vm_id': vm_id,
-                    'hostname': hostname,
-                    'vm_type': vm_type,
-                    'ip_address': ip_address,
-                    'os': os,
-                    'memory': memory,
-                    'disk': disk
-                })
-
-            logger.info(f"Found {len(vms)} VMs")
+            if self.vm_list_expired(response.redirected_to_login, text):
+                if retry and await self.relogin(generation, "home.php without logout link"):
+                    return await self.get_vms(retry=False)
+                return []
+
+            start = time.time()
+            vms = parse_vm_list(text)
+            self.metrics.observe_stage('vm_list_parse', time.time() - start)
             return vms
 
         except Exception as e:
-            logger.error(f"Error getting VMs: {e}")
+            self.log_fetch_error("VMs", e)
             return []
 
-    def get_vm_stats(self, vm_id: str) -> Optional[Dict]:
-        """Get detailed stats for a specific VM."""
-        if not self.ensure_logged_in():
+    async def get_vm_stats(self, vm_id: str, retry: bool = True) -> Optional[Dict]:
+        """Get detailed stats for a specific VM, see RackNerdClient.get_vm_stats."""
+        if not await self.ensure_logged_in():
             return None
+        generation = self._login_generation
 
         try:
-            # Get VM stats via AJAX endpoint
-            response = self.session.post(
-                f'{self.base_url}/_vm_remote.php',
-                data={
-                    'act': 'getstatsdiskusage',
-                    'vi': vm_id
-                }
-            )
+            response = await self.request('POST', '_vm_remote.php', data={
+                'act': 'getstatsdiskusage',
+                'vi': vm_id
+            })
             response.raise_for_status()
 
-            data = response.json()
-            if data.get('success') == '1':
+            redirected = response.redirected_to_login
+            data = self.read_vm_stats(vm_id, redirected, response.text)
+            if data is not None:
                 return data
-            else:
-                logger.warning(f"Failed to get stats for VM {vm_id}")
+
+            if retry and self.stats_failure_expired(vm_id, redirected):
+                if await self.relogin(generation, f"no stats returned for VM {vm_id}"):
+                    return await self.get_vm_stats(vm_id, retry=False)
                 return None
 
-        except Exception as e:
-            logger.error(f"Error getting VM stats for {vm_id}: {e}")
+            self.mark_failing(vm_id)
             return None
 
+        except Exception as e:
+            self.log_fetch_error(f"stats for VM {vm_id}", e)
+            return None
 
-class RackNerdCollector:
-    """Prometheus collector for RackNerd metrics."""
 
-    def __init__(self, client: RackNerdClient):
-        self.client = client
+class ScrapeOverloaded(Exception):
+    """Raised when too many scrapes are already waiting for a refresh."""
+
+
+class SingleFlight:
+    """Runs one call at a time and shares its result with concurrent callers.
+
+    Callers arriving while a call is in flight wait for it instead of
+    starting their own. At most max_waiting callers may wait; any further
+    caller gets ScrapeOverloaded.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error: Optional[BaseException] = None
+
+    def __init__(self, max_waiting: int = 10):
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self.coalesced = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+        self._call: Optional['SingleFlight._Call'] = None
+
+    def do(self, fn, *args):
+        """Run fn(*args), or wait for the result of the call in flight."""
+        with self._lock:
+            call = self._call
+            leader = call is None
+            if leader:
+                call = self._call = self._Call()
+            elif self.waiting >= self.max_waiting:
+                self.shed += 1
+                raise ScrapeOverloaded(f"{self.waiting} scrapes already waiting")
+            else:
+                self.waiting += 1
+                self.coalesced += 1
 
-    def parse_size(self, size_str: str) -> float:
-        """Parse size string (e.g., '20.31 GB') to bytes."""
-        if not size_str or size_str == 'null':
+        if leader:
+            try:
+                call.result = fn(*args)
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    self._call = None
+                call.done.set()
+        else:
+            call.done.wait()
+            with self._lock:
+                self.waiting -= 1
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class VMTable:
+    """The VM list of an account stored by column, one row per VM.
+
+    Label values are interned, so VMs with the same OS or type share one
+    string, and the 7-key dicts parsed from home.php are not kept.
+    """
+
+    __slots__ = ('vm_ids', 'hostnames', 'ip_addresses', 'oses', 'vm_types', 'rows', 'groups')
+
+    def __init__(self, vms: List[Dict]):
+        def column(key: str) -> Tuple[str, ...]:
+            return tuple(sys.intern(str(vm[key])) for vm in vms)
+
+        self.vm_ids = column('vm_id')
+        self.hostnames = column('hostname')
+        self.ip_addresses = column('ip_address')
+        self.oses = column('os')
+        self.vm_types = column('vm_type')
+        # VM ID -> row
+        self.rows = {vm_id: row for row, vm_id in enumerate(self.vm_ids)}
+        # (vm_type, os) -> rows, for the fleet aggregates
+        self.groups: Dict[Tuple[str, str], List[int]] = {}
+        for row, group in enumerate(zip(self.vm_types, self.oses)):
+            self.groups.setdefault(group, []).append(row)
+
+    def __len__(self) -> int:
+        return len(self.vm_ids)
+
+
+# Least age of a VM list dropped because a VM's stats started failing
+MIN_INVALIDATION_AGE = 300.0
+
+
+class InventoryCache:
+    """Parsed VM list of one account, kept until it is ttl seconds old.
+
+    The VM list changes rarely, so home.php is only fetched again once the
+    list expires or is invalidated. A failed fetch keeps the previous list.
+    """
+
+    def __init__(self, ttl: float = 3600.0):
+        self.ttl = ttl
+        # Snapshots share the table until the list is fetched again
+        self.vms = VMTable([])
+        self.fetched_at: Optional[float] = None
+        self.fetches = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def fresh(self) -> bool:
+        return self.fetched_at is not None and time.time() - self.fetched_at < self.ttl
+
+    def age(self) -> Optional[float]:
+        """Seconds since the VM list was fetched, None if it never was."""
+        return None if self.fetched_at is None else time.time() - self.fetched_at
+
+    def get(self, load) -> VMTable:
+        """Return the cached VM list, calling load() first if it is stale."""
+        with self._lock:
+            if not self.fresh():
+                vms = load()
+                self.fetches += 1
+                if vms:
+                    self.vms = VMTable(vms)
+                    self.fetched_at = time.time()
+            return self.vms
+
+    def invalidate(self, reason: str, min_age: float = 0.0):
+        """Fetch the VM list again on the next refresh.
+
+        Does nothing if the list was fetched less than min_age seconds ago.
+        """
+        with self._lock:
+            if self.fetched_at is not None and time.time() - self.fetched_at >= min_age:
+                logger.info(f"VM list invalidated: {reason}")
+                self.fetched_at = None
+                self.invalidations += 1
+
+
+# Size units, upper case. The panel's KB..PB are binary multiples; the
+# IEC names (KiB..PiB) are always binary.
+SIZE_PREFIXES = 'KMGTP'
+BINARY_SIZE_UNITS = {
+    'B': 1,
+    **{f'{prefix}B': 1024 ** power for power, prefix in enumerate(SIZE_PREFIXES, 1)},
+    **{f'{prefix}IB': 1024 ** power for power, prefix in enumerate(SIZE_PREFIXES, 1)},
+}
+DECIMAL_SIZE_UNITS = {
+    **BINARY_SIZE_UNITS,
+    **{f'{prefix}B': 1000 ** power for power, prefix in enumerate(SIZE_PREFIXES, 1)},
+}
+# A number, then an optional unit; anything after it is ignored
+SIZE_PATTERN = re.compile(r'\s*(\d+(?:\.\d*)?|\.\d+)\s*([KMGTP]I?B|B)?', re.IGNORECASE)
+# Longer strings are parsed without being memoized
+MAX_CACHED_SIZE_LENGTH = 32
+
+
+class SizeParser:
+    """Parse panel sizes (e.g. '20.31 GB') to bytes.
+
+    The panel repeats the same few strings on every poll, so results are
+    memoized in a bounded LRU cache.
+    """
+
+    def __init__(self, decimal: bool = False, cache_size: int = 4096):
+        self.units = DECIMAL_SIZE_UNITS if decimal else BINARY_SIZE_UNITS
+        self.cached = lru_cache(maxsize=cache_size)(self.parse_uncached)
+
+    def parse_uncached(self, value: str) -> float:
+        """Parse a size; empty, 'null' and unparsable values are 0, no unit is GB."""
+        if not value or value == 'null':
             return 0.0
-
-        size_str = size_str.strip()
-        match = re.match(r'([\d.]+)\s*(GB|MB|TB|KB)?', size_str, re.IGNORECASE)
+        match = SIZE_PATTERN.match(value)
         if not match:
             return 0.0
+        number, unit = match.groups()
+        return float(number) * self.units[unit.upper() if unit else 'GB']
+
+    def parse(self, value: str) -> float:
+        if value and len(value) > MAX_CACHED_SIZE_LENGTH:
+            return self.parse_uncached(value)
+        return self.cached(value)
+
+
+def parse_percent(value: str) -> float:
+    """Parse a percentage, treating anything unparsable as 0."""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def parse_state(value: str) -> float:
+    """Parse the power state, treating anything unexpected as offline."""
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return 0
+
+
+class StatsMetric(NamedTuple):
+    """A per-VM gauge exported from one getstatsdiskusage field."""
+
+    name: str
+    documentation: str
+    field: str
+    parser: str  # 'size', 'percent' or 'state'
+
+
+class StatsGroup(NamedTuple):
+    """Metrics exported together, if the panel reports the gate field."""
+
+    name: str
+    gate: Optional[str]  # None: always exported when the VM has stats
+    null_unset: bool  # Whether a 'null' gate value counts as not reported
+    metrics: Tuple[StatsMetric, ...]
+
+
+# Per-VM metrics taken from getstatsdiskusage, in export order. A new
+# panel field only needs a StatsMetric here.
+STATS_SCHEMA = (
+    StatsGroup('state', None, False, (
+        StatsMetric('racknerd_vm_state', 'VM power state (1=online, 0=offline)',
+                    'state', 'state'),
+    )),
+    StatsGroup('bandwidth', 'totalbw', False, (
+        StatsMetric('racknerd_bandwidth_total_bytes', 'Total bandwidth allocation in bytes',
+                    'totalbw', 'size'),
+        StatsMetric('racknerd_bandwidth_used_bytes', 'Used bandwidth in bytes',
+                    'usedbw', 'size'),
+        StatsMetric('racknerd_bandwidth_usage_percent', 'Bandwidth usage percentage',
+                    'percentbw', 'percent'),
+    )),
+    StatsGroup('disk', 'totalhdd', False, (
+        StatsMetric('racknerd_disk_total_bytes', 'Total disk space in bytes',
+                    'totalhdd', 'size'),
+        StatsMetric('racknerd_disk_used_bytes', 'Used disk space in bytes',
+                    'usedhdd', 'size'),
+        StatsMetric('racknerd_disk_usage_percent', 'Disk usage percentage',
+                    'percenthdd', 'percent'),
+    )),
+    StatsGroup('memory', 'totalmem', True, (
+        StatsMetric('racknerd_memory_total_bytes', 'Total memory in bytes',
+                    'totalmem', 'size'),
+        StatsMetric('racknerd_memory_used_bytes', 'Used memory in bytes',
+                    'usedmem', 'size'),
+        StatsMetric('racknerd_memory_usage_percent', 'Memory usage percentage',
+                    'percentmem', 'percent'),
+    )),
+    StatsGroup('vswap', 'totalvswap', True, (
+        StatsMetric('racknerd_vswap_total_bytes', 'Total vswap in bytes',
+                    'totalvswap', 'size'),
+        StatsMetric('racknerd_vswap_used_bytes', 'Used vswap in bytes',
+                    'usedvswap', 'size'),
+        StatsMetric('racknerd_vswap_usage_percent', 'VSwap usage percentage',
+                    'percentvswap', 'percent'),
+    )),
+)
+
+# All per-VM metrics in export order; snapshots hold one column per entry
+STATS_METRICS = tuple(metric for group in STATS_SCHEMA for metric in group.metrics)
+STATE_COLUMN = [metric.name for metric in STATS_METRICS].index('racknerd_vm_state')
+# The getstatsdiskusage fields kept from each response, stored as a tuple in this order
+STATS_FIELDS = tuple(dict.fromkeys(
+    [group.gate for group in STATS_SCHEMA if group.gate]
+    + [metric.field for metric in STATS_METRICS]
+))
+STATS_FIELD_INDEX = {field: index for index, field in enumerate(STATS_FIELDS)}
+# (usage percent column, columns of the group) of each group with a usage
+# percentage, for --top-k
+TOP_K_GROUPS = tuple(
+    (STATS_METRICS.index(percent), tuple(STATS_METRICS.index(metric) for metric in group.metrics))
+    for group in STATS_SCHEMA
+    for percent in group.metrics if percent.parser == 'percent'
+)
+# Groups summarized per vm_type and os by the racknerd_fleet_* metrics:
+# bytes are summed, percentages reported as quantiles
+FLEET_GROUPS = ('bandwidth', 'disk', 'memory')
+FLEET_QUANTILES = (0.5, 0.9, 0.99)
+# (STATS_METRICS column, metric) of each summarized metric
+FLEET_METRICS = tuple(
+    (STATS_METRICS.index(metric), metric)
+    for group in STATS_SCHEMA if group.name in FLEET_GROUPS
+    for metric in group.metrics
+)
+
+
+# Labels racknerd_vm_info may carry besides account and the VM label
+VM_INFO_LABELS = ('ip_address', 'os', 'vm_type')
+# How per-VM series identify the VM: label name per --vm-label mode
+VM_LABELS = {'hostname': 'hostname', 'id': 'vm'}
+
 
-        value = float(match.group(1))
-        unit = (match.group(2) or 'GB').upper()
+def parse_vm_info_labels(value: str) -> Tuple[str, ...]:
+    """Parse a comma separated subset of VM_INFO_LABELS, e.g. 'os,vm_type'."""
+    labels = tuple(label.strip() for label in value.split(',') if label.strip())
+    unknown = [label for label in labels if label not in VM_INFO_LABELS]
+    if unknown:
+        raise ValueError(f"Unknown vm_info labels: {', '.join(unknown)}")
+    # Keep the exposition order independent of the order given
+    return tuple(label for label in VM_INFO_LABELS if label in labels)
 
-        multipliers = {
-            'KB': 1024,
-            'MB': 1024 ** 2,
-            'GB': 1024 ** 3,
-            'TB': 1024 ** 4
+
+def short_vm_id(vm_id: str) -> str:
+    """A short ID for a VM that survives renames and reinstalls."""
+    return hashlib.sha1(vm_id.encode()).hexdigest()[:12]
+
+
+def top_rows(column: array, k: int) -> List[int]:
+    """Rows of the k largest values of a column, NaN excluded, in row order.
+
+    Keeps a heap of k rows, so selecting from n rows is O(n log k).
+    """
+    rows = heapq.nlargest(k, (row for row, value in enumerate(column) if value == value),
+                          key=column.__getitem__)
+    return sorted(rows)
+
+
+def quantile(values: List[float], q: float) -> float:
+    """The q-quantile of sorted values, interpolating between the closest ranks."""
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def stats_values(stats: Dict) -> Tuple[Optional[str], ...]:
+    """Keep the STATS_FIELDS of a getstatsdiskusage response, interned.
+
+    The panel repeats the same few strings for every VM, so interning them
+    leaves each VM with a tuple of shared strings instead of a dict.
+    """
+    return tuple(sys.intern(value) if isinstance(value, str) else value
+                 for value in map(stats.get, STATS_FIELDS))
+
+
+class StatsParser:
+    """Turns getstatsdiskusage responses into rows of STATS_METRICS values."""
+
+    def __init__(self, size_parser: Optional[SizeParser] = None):
+        parsers: Dict[str, Callable[[str], float]] = {
+            'size': (size_parser or SizeParser()).parse,
+            'percent': parse_percent,
+            'state': parse_state,
         }
+        # (gate index, null_unset, number of columns, ((field index, parser), ...)) per group
+        self.groups = tuple(
+            (None if group.gate is None else STATS_FIELD_INDEX[group.gate],
+             group.null_unset, len(group.metrics),
+             tuple((STATS_FIELD_INDEX[metric.field], parsers[metric.parser])
+                   for metric in group.metrics))
+            for group in STATS_SCHEMA
+        )
+        # A VM without stats is reported offline, with no other values
+        self.missing = tuple(0.0 if column == STATE_COLUMN else math.nan
+                             for column in range(len(STATS_METRICS)))
+
+    def row(self, values: Optional[Tuple[Optional[str], ...]]) -> Tuple[float, ...]:
+        """Parse stats_values() into one value per STATS_METRICS entry.
+
+        Groups the panel did not report are NaN.
+        """
+        if values is None:
+            return self.missing
+        row = []
+        for gate, null_unset, width, fields in self.groups:
+            if gate is not None:
+                reported = values[gate]
+                if not reported or (null_unset and reported == 'null'):
+                    row.extend((math.nan,) * width)
+                    continue
+            row.extend(parser(values[index]) for index, parser in fields)
+        return tuple(row)
+
+
+class StatsSchedule:
+    """Keeps the last stats of each VM and decides when they are due again.
+
+    The panel returns every metric group in one getstatsdiskusage call, so
+    all of a VM's stats share one ttl: they are fetched again once they are
+    ttl seconds old, and served from the cache in between. When a fetch
+    fails the last good stats are served until they are max_age seconds old.
+    """
+
+    def __init__(self, ttl: float = 0.0, max_age: float = 3600.0):
+        self.ttl = ttl
+        self.max_age = max_age
+        # VM ID -> (stats_values(stats), fetch time)
+        self.cache: Dict[str, Tuple[Tuple[Optional[str], ...], float]] = {}
+        # Stats calls skipped because the cached stats were younger than ttl
+        self.calls_saved = 0
+        self._lock = threading.Lock()
+
+    def due(self, vm_id: str, now: float) -> bool:
+        """Whether a VM has no cached stats, or they are ttl seconds old."""
+        cached = self.cache.get(vm_id)
+        return cached is None or now - cached[1] >= self.ttl
+
+    def split(self, vm_ids: Tuple[str, ...], now: float) -> List[str]:
+        """Return the VMs whose stats need fetching, counting the others as saved."""
+        due = [vm_id for vm_id in vm_ids if self.due(vm_id, now)]
+        with self._lock:
+            self.calls_saved += len(vm_ids) - len(due)
+        return due
+
+    def store(self, vm_id: str, stats: Optional[Dict], now: float):
+        """Cache the stats of a VM; None (a failed fetch) keeps the last good ones."""
+        if stats is not None:
+            values = stats_values(stats)
+            with self._lock:
+                self.cache[vm_id] = (values, now)
+
+    def cached(self, vm_id: str) -> Optional[Tuple[Optional[str], ...]]:
+        """The last good stats_values() of a VM, unless older than max_age."""
+        cached = self.cache.get(vm_id)
+        if cached is None or time.time() - cached[1] > self.max_age:
+            return None
+        return cached[0]
+
+    def fetched_at(self, vm_id: str) -> Optional[float]:
+        cached = self.cache.get(vm_id)
+        return None if cached is None else cached[1]
+
+    def prune(self, vms: VMTable):
+        """Forget VMs that are no longer in the VM list."""
+        with self._lock:
+            for vm_id in [vm_id for vm_id in self.cache if vm_id not in vms.rows]:
+                del self.cache[vm_id]
+
+    def dump(self) -> Dict[str, Dict]:
+        """Return the cached stats in a JSON-serializable form."""
+        with self._lock:
+            return {vm_id: {'stats': {field: value for field, value in zip(STATS_FIELDS, values)
+                                      if value is not None},
+                            'fetched_at': fetched_at}
+                    for vm_id, (values, fetched_at) in self.cache.items()}
+
+    def restore(self, data: Dict[str, Dict]):
+        """Load cached stats returned by dump."""
+        with self._lock:
+            for vm_id, entry in data.items():
+                self.cache[vm_id] = (stats_values(entry['stats']), entry['fetched_at'])
 
-        return value * multipliers.get(unit, 1024 ** 3)
+
+# Seconds between saves of the schedule file while a poll cycle runs
+SCHEDULE_SAVE_INTERVAL = 60.0
+
+
+class Snapshot(NamedTuple):
+    """Immutable view of all VM data from one refresh of the panel.
+
+    VM data is stored by column, in the row order of vms. The arrays are
+    never modified once the snapshot is published.
+    """
+
+    vms: VMTable
+    available: array  # 'b': 1 where the VM has stats, possibly the last good ones
+    fetched_at: array  # 'd': when each VM's stats were fetched, NaN without stats
+    values: Tuple[array, ...]  # 'd': one column per STATS_METRICS entry, NaN if not reported
+    timestamp: float
+    duration: float
+
+
+class RackNerdPoller:
+    """Builds snapshots of VM data, on demand or from a background thread."""
+
+    def __init__(self, client: RackNerdClient, stats_concurrency: int = 8,
+                 interval: float = 0, max_waiting_scrapes: int = 10,
+                 inventory_ttl: float = 3600.0,
+                 stats_ttl: float = 0.0,
+                 schedule_file: Optional[str] = None, max_stats_age: float = 3600.0,
+                 size_parser: Optional[SizeParser] = None, publish_interval: float = 0.0):
+        self.client = client
+        self.interval = interval
+        # Least seconds between snapshots published from background polls
+        self.publish_interval = publish_interval
+        self.stats_concurrency = max(1, stats_concurrency)
+        self.inventory = InventoryCache(inventory_ttl)
+        self.stats_schedule = StatsSchedule(stats_ttl, max_stats_age)
+        self.stats_parser = StatsParser(size_parser)
+        # Saves the polled stats so a restart resumes the schedule
+        self.schedule_file = schedule_file
+        self.schedule_saved_at = 0.0
+        # Start times of recent background polls, and how late the last one was
+        self.poll_times = deque()
+        self.schedule_lag = 0.0
+        # VMs polled since the last snapshot, and how long the last poll took
+        self.unpublished = set()
+        self.poll_duration = 0.0
+        self._publish_lock = threading.Lock()
+        # Coalesces concurrent on-demand refreshes into one panel sweep
+        self.single_flight = SingleFlight(max_waiting_scrapes)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.stats_concurrency,
+            thread_name_prefix='racknerd-stats'
+        )
+        self.snapshot: Optional[Snapshot] = None
+        # Whether the last on-demand refresh got stats for a VM that was due, if any was
+        self.refresh_ok = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def login(self) -> bool:
+        """Login to RackNerd control panel."""
+        return self.client.login()
+
+    def restore_session(self) -> bool:
+        """Restore a saved session instead of logging in."""
+        return self.client.load_session()
+
+    def fetch_vm_stats(self, vm_id: str) -> Optional[Dict]:
+        """Fetch the stats of one VM on the calling thread."""
+        return self.client.get_vm_stats(vm_id)
+
+    def fetch_stats(self, vm_ids: List[str],
+                    deadline: Optional[float] = None) -> List[Optional[Dict]]:
+        """Fetch stats for all VMs concurrently, returned in VM order.
+
+        VMs whose stats have not arrived by the deadline get None.
+        """
+        futures = [self.executor.submit(self.fetch_vm_stats, vm_id) for vm_id in vm_ids]
+        timeout = None if deadline is None else max(0.0, deadline - time.time())
+        _, pending = wait(futures, timeout=timeout)
+        if pending:
+            logger.warning(f"Scrape deadline reached, {len(pending)} of {len(vm_ids)} VMs without stats")
+            for future in pending:
+                future.cancel()
+        return [None if future in pending else future.result() for future in futures]
+
+    def load_inventory(self) -> List[Dict]:
+        """Fetch and parse the VM list from the panel."""
+        return self.client.get_vms()
+
+    def fetch_all(self, deadline: Optional[float] = None) -> VMTable:
+        """Fetch the stats that are due for the VMs in the cached VM list.
+
+        VMs with no metric group due, or whose fetch failed, are served
+        from the stats schedule.
+        """
+        vms = self.inventory.get(self.load_inventory)
+        schedule = self.stats_schedule
+        self.prune(vms)
+
+        start = time.time()
+        due = schedule.split(vms.vm_ids, start)
+        fetched = dict(zip(due, self.fetch_stats(due, deadline)))
+        self.client.metrics.observe_stage('stats_fetch', time.time() - start)
+        for vm_id, vm_stats in fetched.items():
+            schedule.store(vm_id, vm_stats, start)
+        self.refresh_ok = not fetched or any(vm_stats is not None for vm_stats in fetched.values())
+
+        # A VM whose stats started failing in a fresh session may have been
+        # removed; fetches cut off by the deadline or failing on errors do not count
+        failing = sum(1 for vm_id, vm_stats in fetched.items()
+                      if vm_stats is None and self.client.failing_vms.get(vm_id, 0) >= start)
+        if failing:
+            self.inventory.invalidate(f"stats of {failing} VMs started failing",
+                                      MIN_INVALIDATION_AGE)
+
+        return vms
+
+    def prune(self, vms: VMTable):
+        """Forget the cached stats and failures of VMs no longer in the VM list."""
+        self.stats_schedule.prune(vms)
+        failing_vms = self.client.failing_vms
+        for vm_id in list(failing_vms):
+            if vm_id not in vms.rows:
+                failing_vms.pop(vm_id, None)
+
+    def build_snapshot(self, vms: VMTable, duration: float) -> Snapshot:
+        """Parse the cached stats of every VM into a new snapshot."""
+        schedule = self.stats_schedule
+        available = array('b', bytes(len(vms)))
+        fetched_at = array('d', [math.nan]) * len(vms)
+        rows = []
+        for row, vm_id in enumerate(vms.vm_ids):
+            stats = schedule.cached(vm_id)
+            if stats is not None:
+                available[row] = 1
+                fetched_at[row] = schedule.fetched_at(vm_id)
+            rows.append(self.stats_parser.row(stats))
+        if rows:
+            values = tuple(array('d', column) for column in zip(*rows))
+        else:
+            values = tuple(array('d') for _ in STATS_METRICS)
+        return Snapshot(vms, available, fetched_at, values, time.time(), duration)
+
+    def update_snapshot(self, snapshot: Snapshot, vm_ids, duration: float) -> Snapshot:
+        """Copy a snapshot with the cached stats of some VMs parsed into their rows."""
+        available = snapshot.available[:]
+        fetched_at = snapshot.fetched_at[:]
+        values = tuple(column[:] for column in snapshot.values)
+        for vm_id in vm_ids:
+            row = snapshot.vms.rows[vm_id]
+            stats = self.stats_schedule.cached(vm_id)
+            available[row] = stats is not None
+            fetched_at[row] = math.nan if stats is None else self.stats_schedule.fetched_at(vm_id)
+            for column, value in zip(values, self.stats_parser.row(stats)):
+                column[row] = value
+        return Snapshot(snapshot.vms, available, fetched_at, values, time.time(), duration)
+
+    def refresh(self, deadline: Optional[float] = None) -> Snapshot:
+        """Fetch all VM data from the panel and publish a new snapshot."""
+        start = time.time()
+        vms = self.fetch_all(deadline)
+        snapshot = self.build_snapshot(vms, time.time() - start)
+
+        # Keep serving the previous snapshot if the VM list could not be fetched
+        if vms or self.snapshot is None:
+            self.snapshot = snapshot
+        return snapshot
+
+    def get_snapshot(self, deadline: Optional[float] = None) -> Optional[Snapshot]:
+        """Return the latest snapshot, refreshing first if not polling.
+
+        Concurrent callers share a single refresh.
+        """
+        if self._thread is None:
+            return self.single_flight.do(self.refresh, deadline)
+        return self.snapshot
+
+    def start(self):
+        """Start polling every VM in the background once per interval."""
+        self.load_schedule()
+        self._thread = threading.Thread(target=self._run, name='racknerd-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background refresh loop."""
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_cycle()
+            except Exception as e:
+                logger.error(f"Error refreshing snapshot: {e}")
+                self._stop.wait(self.interval)
+
+    @staticmethod
+    def poll_offsets(vm_ids: Tuple[str, ...], interval: float) -> List[Tuple[float, str]]:
+        """Return (offset into the interval, VM ID) pairs, ordered by offset.
+
+        VMs get evenly spaced slots, each shifted by a jitter derived from
+        its vm_id, so polls form a steady stream and every VM keeps the same
+        offset across cycles and restarts.
+        """
+        if not vm_ids:
+            return []
+        spacing = interval / len(vm_ids)
+        offsets = []
+        for rank, vm_id in enumerate(sorted(vm_ids)):
+            digest = hashlib.sha1(vm_id.encode()).digest()
+            jitter = int.from_bytes(digest[:4], 'big') / 2 ** 32
+            offsets.append(((rank + jitter) * spacing, vm_id))
+        return offsets
+
+    def run_cycle(self):
+        """Poll every VM once, each at its own offset into the current interval.
+
+        Cycles are aligned to the clock, so a restarted exporter picks up
+        the schedule where it left off. VMs without any stats are polled at
+        once; VMs whose slot has already passed wait for the next cycle.
+        """
+        cycle_start = time.time() // self.interval * self.interval
+        vms = self.inventory.get(self.load_inventory)
+        schedule = self.stats_schedule
+        self.prune(vms)
+        self.publish(0.0)
+
+        polled = set()
+        for vm_id in vms.vm_ids:
+            if schedule.fetched_at(vm_id) is None:
+                polled.add(vm_id)
+                self.submit_poll(vm_id, time.time())
+
+        for offset, vm_id in self.poll_offsets(vms.vm_ids, self.interval):
+            slot = cycle_start + offset
+            fetched_at = schedule.fetched_at(vm_id)
+            if (vm_id in polled or slot < time.time()
+                    or (fetched_at is not None and fetched_at >= cycle_start)):
+                continue
+            if self.wait_until(slot):
+                return
+            self.submit_poll(vm_id, slot)
+            if time.time() - self.schedule_saved_at >= SCHEDULE_SAVE_INTERVAL:
+                self.save_schedule()
+
+        self.wait_until(cycle_start + self.interval)
+        self.save_schedule()
+
+    def wait_until(self, when: float) -> bool:
+        """Wait until when, publishing polled stats as they fall due.
+
+        Returns True if the poller was stopped meanwhile.
+        """
+        while True:
+            remaining = when - time.time()
+            if remaining <= 0:
+                return False
+            if self._stop.wait(min(remaining, self.publish_interval or remaining)):
+                return True
+            self.publish_polled()
+
+    def submit_poll(self, vm_id: str, slot: float):
+        """Poll one VM in the background."""
+        self.executor.submit(self.poll_vm, vm_id, slot)
+
+    def poll_vm(self, vm_id: str, slot: float):
+        """Fetch the stats of one VM if due and publish a new snapshot."""
+        start = self.start_poll(vm_id, slot)
+        if start is not None:
+            self.finish_poll(vm_id, self.fetch_vm_stats(vm_id), start)
+
+    def start_poll(self, vm_id: str, slot: float) -> Optional[float]:
+        """Record the start of a background poll; None if the VM is not due."""
+        start = time.time()
+        self.schedule_lag = max(0.0, start - slot)
+        if not self.stats_schedule.split((vm_id,), start):
+            return None
+        with self._publish_lock:
+            self.poll_times.append(start)
+        return start
+
+    def finish_poll(self, vm_id: str, vm_stats: Optional[Dict], start: float):
+        """Store the stats of a background poll and publish them when due."""
+        self.stats_schedule.store(vm_id, vm_stats, start)
+        if vm_stats is None and self.client.failing_vms.get(vm_id, 0) >= start:
+            self.inventory.invalidate(f"stats of VM {vm_id} started failing", MIN_INVALIDATION_AGE)
+        with self._publish_lock:
+            self.unpublished.add(vm_id)
+            self.poll_duration = time.time() - start
+        self.publish_polled()
+
+    def publish_polled(self):
+        """Publish the VMs polled since the last snapshot, at most once per publish_interval.
+
+        Batching polls keeps the snapshot, and the exposition cached for
+        it, unchanged between publishes.
+        """
+        with self._publish_lock:
+            snapshot = self.snapshot
+            if not self.unpublished or (snapshot is not None
+                                        and time.time() - snapshot.timestamp < self.publish_interval):
+                return
+            self._publish(self.poll_duration, self.unpublished)
+
+    def publish(self, duration: float, vm_ids: Tuple[str, ...] = ()):
+        """Publish a snapshot of the cached VM list and stats.
+
+        After polling some VMs only their rows are parsed again, into a copy
+        of the current snapshot's columns.
+        """
+        with self._publish_lock:
+            self._publish(duration, vm_ids)
+
+    def _publish(self, duration: float, vm_ids):
+        vms = self.inventory.vms
+        snapshot = self.snapshot
+        if (vm_ids and snapshot is not None and snapshot.vms is vms
+                and all(vm_id in vms.rows for vm_id in vm_ids)):
+            self.snapshot = self.update_snapshot(snapshot, vm_ids, duration)
+        else:
+            self.snapshot = self.build_snapshot(vms, duration)
+        self.unpublished = set()
+
+    def healthy(self, since: float) -> bool:
+        """Whether VM stats are coming from the panel, for probe_success.
+
+        Never while the circuit of _vm_remote.php is not closed. With
+        background polling, some VM's stats must have been fetched within
+        the refresh interval plus the stats TTL. On demand, the snapshot
+        must be refreshed after since, by a refresh that got stats.
+        """
+        breaker = self.client.breakers.get('_vm_remote.php')
+        if breaker is not None and breaker.state != 'closed':
+            return False
+        snapshot = self.snapshot
+        if snapshot is None or not snapshot.vms:
+            return False
+        if self.interval > 0:
+            newest = max((fetched_at for fetched_at in snapshot.fetched_at if fetched_at == fetched_at),
+                         default=None)
+            return (newest is not None
+                    and time.time() - newest <= self.interval + self.stats_schedule.ttl)
+        return snapshot.timestamp >= since and self.refresh_ok
+
+    def poll_rate(self) -> float:
+        """Background stats polls per second over the last interval."""
+        if self.interval <= 0:
+            return 0.0
+        cutoff = time.time() - self.interval
+        with self._publish_lock:
+            while self.poll_times and self.poll_times[0] < cutoff:
+                self.poll_times.popleft()
+            return len(self.poll_times) / self.interval
+
+    def save_schedule(self):
+        """Save the polled stats to the schedule file, if configured."""
+        if not self.schedule_file:
+            return
+        self.schedule_saved_at = time.time()
+        try:
+            save_json(self.schedule_file, self.stats_schedule.dump())
+        except (OSError, TypeError) as e:
+            logger.warning(f"Failed to save schedule to {self.schedule_file}: {e}")
+
+    def load_schedule(self):
+        """Restore stats saved by save_schedule, so restarts do not poll every VM at once."""
+        if not self.schedule_file:
+            return
+        self.stats_schedule.restore(load_json(self.schedule_file, {}))
+        if self.stats_schedule.cache:
+            logger.info(f"Restored stats of {len(self.stats_schedule.cache)} VMs from {self.schedule_file}")
+
+
+class EventLoopThread:
+    """An asyncio event loop running on its own daemon thread.
+
+    Shared by the async pollers of all accounts, so their requests are in
+    flight on one thread.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name='racknerd-asyncio', daemon=True).start()
+
+    def submit(self, coro) -> Future:
+        """Schedule a coroutine on the event loop."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        """Run a coroutine on the event loop and wait for its result."""
+        return self.submit(coro).result()
+
+
+class AsyncRackNerdPoller(RackNerdPoller):
+    """Poller driving an AsyncRackNerdClient on an event loop thread.
+
+    Background polls are scheduled on the event loop, so no worker thread
+    waits for them.
+    """
+
+    def __init__(self, client: AsyncRackNerdClient, stats_concurrency: int = 8,
+                 interval: float = 0, max_waiting_scrapes: int = 10,
+                 inventory_ttl: float = 3600.0,
+                 stats_ttl: float = 0.0,
+                 schedule_file: Optional[str] = None, max_stats_age: float = 3600.0,
+                 size_parser: Optional[SizeParser] = None, publish_interval: float = 0.0,
+                 event_loop: Optional[EventLoopThread] = None):
+        super().__init__(client, stats_concurrency, interval, max_waiting_scrapes,
+                         inventory_ttl, stats_ttl, schedule_file, max_stats_age,
+                         size_parser, publish_interval)
+        self.event_loop = event_loop or EventLoopThread()
+
+    def run(self, coro):
+        """Run a coroutine on the event loop and wait for its result."""
+        return self.event_loop.run(coro)
+
+    def submit_poll(self, vm_id: str, slot: float):
+        self.event_loop.submit(self._poll_vm(vm_id, slot))
+
+    async def _poll_vm(self, vm_id: str, slot: float):
+        start = self.start_poll(vm_id, slot)
+        if start is not None:
+            self.finish_poll(vm_id, await self.client.get_vm_stats(vm_id), start)
+
+    def login(self) -> bool:
+        return self.run(self.client.login())
+
+    def restore_session(self) -> bool:
+        return self.run(self.client.load_session())
+
+    def load_inventory(self) -> List[Dict]:
+        return self.run(self.client.get_vms())
+
+    def fetch_vm_stats(self, vm_id: str) -> Optional[Dict]:
+        return self.run(self.client.get_vm_stats(vm_id))
+
+    def fetch_stats(self, vm_ids: List[str],
+                    deadline: Optional[float] = None) -> List[Optional[Dict]]:
+        return self.run(self._fetch_stats(vm_ids, deadline))
+
+    async def _fetch_stats(self, vm_ids: List[str],
+                           deadline: Optional[float]) -> List[Optional[Dict]]:
+        semaphore = asyncio.Semaphore(self.stats_concurrency)
+
+        async def fetch(vm_id: str) -> Optional[Dict]:
+            async with semaphore:
+                return await self.client.get_vm_stats(vm_id)
+
+        tasks = [asyncio.ensure_future(fetch(vm_id)) for vm_id in vm_ids]
+        if not tasks:
+            return []
+        timeout = None if deadline is None else max(0.0, deadline - time.time())
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logger.warning(f"Scrape deadline reached, {len(pending)} of {len(vm_ids)} VMs without stats")
+            for task in pending:
+                task.cancel()
+        return [None if task in pending else task.result() for task in tasks]
+
+
+class RackNerdCollector:
+    """Prometheus collector for RackNerd metrics."""
+
+    def __init__(self, pollers: Dict[str, RackNerdPoller], top_k: int = 0,
+                 info_labels: Tuple[str, ...] = VM_INFO_LABELS, vm_label: str = 'hostname',
+                 max_series: int = 0):
+        # Account name -> poller
+        self.pollers = pollers
+        # Per-VM series only for the top_k VMs by each usage percentage; 0 is all VMs
+        self.top_k = top_k
+        # Optional labels of racknerd_vm_info
+        self.info_labels = info_labels
+        # Label identifying the VM in per-VM series: its hostname, or a short ID
+        self.vm_label = vm_label
+        self.vm_label_name = VM_LABELS[vm_label]
+        # Most per-VM series per scrape, whole VMs beyond it are dropped; 0 is no cap
+        self.max_series = max_series
+        # Account -> per-VM series dropped by the cap
+        self.series_dropped: Dict[str, int] = {}
+        # Room for every scrape an account's single flight admits, so scrapes
+        # reach it concurrently and are coalesced or shed there, not queued here
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, sum(poller.single_flight.max_waiting + 1 for poller in pollers.values())),
+            thread_name_prefix='racknerd-accounts'
+        )
+        # Account -> (VM table, per-VM label sets), reused until the VM list changes
+        self.vm_labels: Dict[str, Tuple[VMTable, List[Dict[str, str]], List[Dict[str, str]]]] = {}
+        # (snapshots, per-account selection), reused until a snapshot changes
+        self.selection: Optional[Tuple[Tuple[Snapshot, ...], List[Tuple]]] = None
+
+    def describe(self):
+        """Describe no metrics up front.
+
+        Without describe() the registry would call collect() when the
+        collector is registered, fetching every VM from the panel.
+        """
+        return []
 
     def collect(self):
-        """Collect metrics from RackNerd."""
-        # Get all VMs
-        vms = self.client.get_vms()
+        """Collect metrics from the latest snapshot of every account.
+
+        While MetricsApp serves the per-VM and fleet families of some
+        snapshots from cache, only the rest is collected, for those snapshots.
+        """
+        cached = getattr(_scrape, 'cached_snapshots', None)
+        snapshots = self.get_snapshots(scrape_deadline()) if cached is None else cached
+
+        # Time spent building and serializing families, reported next scrape
+        start = time.time()
+        try:
+            yield from self.collect_exporter_metrics(snapshots)
+            yield from self.collect_scrape_vm_metrics(snapshots)
+            if cached is None:
+                yield from self.collect_snapshot_metrics(snapshots)
+        finally:
+            for poller in self.pollers.values():
+                poller.client.metrics.observe_stage('serialize', time.time() - start)
+
+    def collect_snapshot_metrics(self, snapshots: List[Tuple[str, Snapshot]]):
+        """Collect the families that only change with the snapshots."""
+        yield from self.collect_vm_metrics(snapshots)
+        yield from self.collect_fleet_metrics(snapshots)
+
+    def get_snapshots(self, deadline: Optional[float] = None) -> List[Tuple[str, Snapshot]]:
+        """Return (account, latest snapshot) of every account with one."""
+        # Refresh all accounts in parallel; the deadline is per serving thread
+        accounts = list(self.pollers.items())
+        if len(accounts) == 1:
+            results = [accounts[0][1].get_snapshot(deadline)]
+        else:
+            results = list(self.executor.map(lambda item: item[1].get_snapshot(deadline), accounts))
+
+        snapshots = []
+        for (account, _), snapshot in zip(accounts, results):
+            if snapshot is None:
+                logger.warning(f"No snapshot available yet for account {account}")
+            else:
+                snapshots.append((account, snapshot))
+        return snapshots
+
+    def collect_exporter_metrics(self, snapshots: List[Tuple[str, Snapshot]]):
+        """Collect metrics about the exporter itself."""
+        snapshot_age = GaugeMetricFamily(
+            'racknerd_snapshot_age_seconds',
+            'Seconds since the served VM data was fetched from the panel',
+            labels=['account']
+        )
+        refresh_duration = GaugeMetricFamily(
+            'racknerd_last_refresh_duration_seconds',
+            'Duration of the last refresh of VM data from the panel',
+            labels=['account']
+        )
+        for account, snapshot in snapshots:
+            snapshot_age.add_metric([account], max(0.0, time.time() - snapshot.timestamp))
+            refresh_duration.add_metric([account], snapshot.duration)
+
+        inventory_age = GaugeMetricFamily(
+            'racknerd_inventory_age_seconds',
+            'Seconds since the VM list was fetched from the panel',
+            labels=['account']
+        )
+        inventory_fetches = CounterMetricFamily(
+            'racknerd_inventory_fetches',
+            'Fetches of the VM list from the panel',
+            labels=['account']
+        )
+        inventory_invalidations = CounterMetricFamily(
+            'racknerd_inventory_invalidations',
+            'Times the cached VM list was dropped before it expired',
+            labels=['account']
+        )
+        stats_calls_saved = CounterMetricFamily(
+            'racknerd_stats_calls_saved',
+            'VM stats calls skipped because the cached stats were younger than the stats TTL',
+            labels=['account']
+        )
+        stats_ttl = GaugeMetricFamily(
+            'racknerd_stats_ttl_seconds',
+            'Configured age at which the cached stats of a VM are fetched again',
+            labels=['account']
+        )
+        poll_rate = GaugeMetricFamily(
+            'racknerd_stats_poll_rate',
+            'Background VM stats polls per second over the last refresh interval',
+            labels=['account']
+        )
+        poll_lag = GaugeMetricFamily(
+            'racknerd_stats_poll_lag_seconds',
+            'How late the last background VM stats poll started after its slot',
+            labels=['account']
+        )
+
+        vms_failing = GaugeMetricFamily(
+            'racknerd_vm_stats_failing',
+            'VMs whose stats calls fail even right after logging in again',
+            labels=['account']
+        )
+        probes_avoided = CounterMetricFamily(
+            'racknerd_session_probes_avoided',
+            'Session validation requests skipped by trusting the current session',
+            labels=['account']
+        )
+        scrapes_coalesced = CounterMetricFamily(
+            'racknerd_scrapes_coalesced',
+            'Scrapes served by waiting for a refresh already in progress',
+            labels=['account']
+        )
+        scrapes_shed = CounterMetricFamily(
+            'racknerd_scrapes_shed',
+            'Scrapes rejected with 503 because too many were waiting',
+            labels=['account']
+        )
+        login_failures = GaugeMetricFamily(
+            'racknerd_login_consecutive_failures',
+            'Failed login attempts since the last successful login',
+            labels=['account']
+        )
+        login_backoff = GaugeMetricFamily(
+            'racknerd_login_backoff_seconds',
+            'Seconds until the next login attempt is allowed',
+            labels=['account']
+        )
+        request_duration = HistogramMetricFamily(
+            'racknerd_panel_request_duration_seconds',
+            'Latency of requests to the panel',
+            labels=['account', 'endpoint', 'outcome']
+        )
+        requests_total = CounterMetricFamily(
+            'racknerd_panel_requests',
+            'Requests made to the panel',
+            labels=['account', 'endpoint', 'outcome']
+        )
+        bytes_received = CounterMetricFamily(
+            'racknerd_panel_received_bytes',
+            'Response body bytes received from the panel',
+            labels=['account', 'endpoint']
+        )
+        logins = CounterMetricFamily(
+            'racknerd_logins',
+            'Login attempts made to the panel',
+            labels=['account']
+        )
+        relogins = CounterMetricFamily(
+            'racknerd_relogins',
+            'Login attempts made because the session expired',
+            labels=['account']
+        )
+        concurrency_limit = GaugeMetricFamily(
+            'racknerd_panel_concurrency_limit',
+            'Current adaptive limit on panel requests in flight',
+            labels=['account']
+        )
+        in_flight = GaugeMetricFamily(
+            'racknerd_panel_requests_in_flight',
+            'Panel requests currently in flight',
+            labels=['account']
+        )
+        throttles = CounterMetricFamily(
+            'racknerd_panel_throttles',
+            'Panel responses that made the exporter back off',
+            labels=['account', 'reason']
+        )
+        retry_pause = GaugeMetricFamily(
+            'racknerd_panel_retry_after_seconds',
+            'Seconds until requests resume after a Retry-After from the panel',
+            labels=['account']
+        )
+        circuit_state = GaugeMetricFamily(
+            'racknerd_panel_circuit_state',
+            'Circuit breaker state of a panel endpoint (0=closed, 1=half-open, 2=open)',
+            labels=['account', 'endpoint']
+        )
+        circuit_rejected = CounterMetricFamily(
+            'racknerd_panel_circuit_rejected',
+            'Panel requests not sent because the endpoint circuit was open',
+            labels=['account', 'endpoint']
+        )
+        scrape_duration = GaugeMetricFamily(
+            'racknerd_scrape_duration_seconds',
+            'Duration of each stage of the last refresh and serialization',
+            labels=['account', 'stage']
+        )
+
+        for account, poller in self.pollers.items():
+            client = poller.client
+            metrics = client.metrics
+            probes_avoided.add_metric([account], client.probes_avoided)
+            vms_failing.add_metric([account], len(client.failing_vms))
+            scrapes_coalesced.add_metric([account], poller.single_flight.coalesced)
+            scrapes_shed.add_metric([account], poller.single_flight.shed)
+            login_failures.add_metric([account], client.backoff.failures)
+            login_backoff.add_metric([account], client.backoff.remaining())
+
+            inventory = poller.inventory
+            if inventory.age() is not None:
+                inventory_age.add_metric([account], inventory.age())
+            inventory_fetches.add_metric([account], inventory.fetches)
+            inventory_invalidations.add_metric([account], inventory.invalidations)
+            stats_calls_saved.add_metric([account], poller.stats_schedule.calls_saved)
+            stats_ttl.add_metric([account], poller.stats_schedule.ttl)
+            poll_rate.add_metric([account], poller.poll_rate())
+            poll_lag.add_metric([account], poller.schedule_lag)
+
+            for endpoint, outcome, buckets, count, total in metrics.histograms():
+                request_duration.add_metric([account, endpoint, outcome], buckets, total)
+                requests_total.add_metric([account, endpoint, outcome], count)
+            for endpoint, size in sorted(metrics.bytes_received.items()):
+                bytes_received.add_metric([account, endpoint], size)
+
+            logins.add_metric([account], metrics.logins)
+            relogins.add_metric([account], metrics.relogins)
+
+            limiter = client.limiter
+            concurrency_limit.add_metric([account], int(limiter.limit))
+            in_flight.add_metric([account], limiter.in_flight)
+            for reason, count in sorted(limiter.throttles.items()):
+                throttles.add_metric([account, reason], count)
+            retry_pause.add_metric([account], limiter.pause_remaining())
+            for endpoint, breaker in sorted(client.breakers.items()):
+                circuit_state.add_metric([account, endpoint],
+                                         CircuitBreaker.STATES.index(breaker.state))
+                circuit_rejected.add_metric([account, endpoint], breaker.rejected)
+            for stage in PanelMetrics.STAGES:
+                if stage in metrics.stages:
+                    scrape_duration.add_metric([account, stage], metrics.stages[stage])
+
+        yield snapshot_age
+        yield refresh_duration
+        yield inventory_age
+        yield inventory_fetches
+        yield inventory_invalidations
+        yield stats_calls_saved
+        yield stats_ttl
+        yield poll_rate
+        yield poll_lag
+        yield probes_avoided
+        yield vms_failing
+        yield login_failures
+        yield login_backoff
+        yield scrapes_coalesced
+        yield scrapes_shed
+        yield request_duration
+        yield requests_total
+        yield bytes_received
+        yield logins
+        yield relogins
+        yield concurrency_limit
+        yield in_flight
+        yield throttles
+        yield retry_pause
+        yield circuit_state
+        yield circuit_rejected
+        yield scrape_duration
+
+        rate_limiters = {id(poller.client.rate_limiter): poller.client.rate_limiter
+                         for poller in self.pollers.values()
+                         if poller.client.rate_limiter is not None}
+        if rate_limiters:
+            rate_limit_delays = CounterMetricFamily(
+                'racknerd_panel_rate_limit_delays',
+                'Panel requests delayed by the --max-request-rate cap'
+            )
+            rate_limit_delays.add_metric([], sum(bucket.delayed for bucket in rate_limiters.values()))
+            yield rate_limit_delays
+
+    def labels(self, account: str,
+               vms: VMTable) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+        """Return the per-VM and vm_info label sets of each VM of an account.
+
+        Built once per VM list fetched from the panel, not every scrape, and
+        shared by the samples of all per-VM families.
+        """
+        cached = self.vm_labels.get(account)
+        if cached is not None and cached[0] is vms:
+            return cached[1], cached[2]
+        if self.vm_label == 'id':
+            keys = [short_vm_id(vm_id) for vm_id in vms.vm_ids]
+        else:
+            keys = vms.hostnames
+        vm_labels = [{'account': account, self.vm_label_name: key} for key in keys]
+
+        info_columns = {'ip_address': vms.ip_addresses, 'os': vms.oses, 'vm_type': vms.vm_types}
+        info_labels = []
+        for row, labels in enumerate(vm_labels):
+            labels = dict(labels)
+            if self.vm_label != 'hostname':
+                labels['hostname'] = vms.hostnames[row]
+            for label in self.info_labels:
+                labels[label] = info_columns[label][row]
+            info_labels.append(labels)
+        self.vm_labels[account] = (vms, vm_labels, info_labels)
+        return vm_labels, info_labels
+
+    @staticmethod
+    def add_column(family: GaugeMetricFamily, labels: List[Dict[str, str]], column,
+                   rows: Optional[List[int]] = None):
+        """Add one sample per VM from a snapshot column, skipping NaN.
+
+        With rows, only those VMs are added.
+        """
+        name = family.name
+        if rows is not None:
+            labels = map(labels.__getitem__, rows)
+            column = map(column.__getitem__, rows)
+        family.samples.extend(Sample(name, vm_labels, value)
+                              for vm_labels, value in zip(labels, column) if value == value)
+
+    def select_rows(self, snapshot: Snapshot) -> Tuple[Optional[List[int]], List[Optional[List[int]]]]:
+        """Return the VMs to export per-VM series for, and the VMs of each column.
+
+        Without top_k every VM is exported (None). Otherwise each group with
+        a usage percentage is exported for its top_k VMs by that percentage,
+        and the other families for the VMs selected by any group.
+        """
+        if not self.top_k:
+            return None, [None] * len(STATS_METRICS)
+        selected: List[Optional[List[int]]] = [None] * len(STATS_METRICS)
+        union = set()
+        for percent_column, columns in TOP_K_GROUPS:
+            rows = top_rows(snapshot.values[percent_column], self.top_k)
+            union.update(rows)
+            for column in columns:
+                selected[column] = rows
+        union = sorted(union)
+        return union, [union if rows is None else rows for rows in selected]
+
+    @staticmethod
+    def cap_rows(snapshot: Snapshot, rows: Optional[List[int]],
+                 column_rows: List[Optional[List[int]]], budget: int):
+        """Keep the VMs, in VM list order, whose per-VM series fit in budget.
+
+        Returns the kept rows, the kept rows of each column, and the number
+        of series kept and dropped.
+        """
+        every_row = range(len(snapshot.vms))
+        counts = [0] * len(snapshot.vms)
+        # vm_info and racknerd_vm_stats_available, plus the age if the VM has stats
+        fetched_at = snapshot.fetched_at
+        for row in every_row if rows is None else rows:
+            counts[row] = 3 if fetched_at[row] == fetched_at[row] else 2
+        for column, selected in zip(snapshot.values, column_rows):
+            for row in every_row if selected is None else selected:
+                value = column[row]
+                if value == value:
+                    counts[row] += 1
+
+        kept = set()
+        used = 0
+        for row, count in enumerate(counts):
+            if count and used + count <= budget:
+                kept.add(row)
+                used += count
+        dropped = sum(counts) - used
+
+        def keep(selected: Optional[List[int]]) -> List[int]:
+            return [row for row in (every_row if selected is None else selected) if row in kept]
+
+        return keep(rows), [keep(selected) for selected in column_rows], used, dropped
+
+    def select(self, snapshots: List[Tuple[str, Snapshot]]) -> List[Tuple]:
+        """Return (rows, column rows, series dropped) to export of each account.
+
+        Applies top_k, then the max_series budget across accounts in order.
+        Reused until a snapshot changes.
+        """
+        key = tuple(snapshot for _, snapshot in snapshots)
+        cached = self.selection
+        if (cached is not None and len(cached[0]) == len(key)
+                and all(a is b for a, b in zip(cached[0], key))):
+            return cached[1]
+
+        selection = []
+        budget = self.max_series
+        for account, snapshot in snapshots:
+            rows, column_rows = self.select_rows(snapshot)
+            dropped = 0
+            if self.max_series:
+                rows, column_rows, used, dropped = self.cap_rows(snapshot, rows, column_rows, budget)
+                budget -= used
+                if dropped:
+                    logger.debug(f"Dropped {dropped} per-VM series of account {account} "
+                                 f"over the --max-series cap")
+            selection.append((rows, column_rows, dropped))
+        self.selection = (key, selection)
+        return selection
+
+    def collect_scrape_vm_metrics(self, snapshots: List[Tuple[str, Snapshot]]):
+        """Collect the per-VM metrics that change between snapshots.
+
+        The age of each VM's stats grows with time, and the series left out
+        by the cap are counted once per scrape.
+        """
+        if not any(len(snapshot.vms) for _, snapshot in snapshots):
+            return
+
+        vm_stats_age = GaugeMetricFamily(
+            'racknerd_vm_stats_age_seconds',
+            'Seconds since the served VM stats were fetched from the panel',
+            labels=['account', self.vm_label_name]
+        )
+        now = time.time()
+        for (account, snapshot), (rows, _, dropped) in zip(snapshots, self.select(snapshots)):
+            vm_labels, _ = self.labels(account, snapshot.vms)
+            self.add_column(vm_stats_age, vm_labels,
+                            [max(0.0, now - fetched_at) if fetched_at == fetched_at else math.nan
+                             for fetched_at in snapshot.fetched_at], rows)
+            if dropped:
+                self.series_dropped[account] = self.series_dropped.get(account, 0) + dropped
+        yield vm_stats_age
+
+        if self.max_series:
+            series_dropped = CounterMetricFamily(
+                'racknerd_series_dropped',
+                'Per-VM series left out of scrapes by the --max-series cap',
+                labels=['account']
+            )
+            for account, _ in snapshots:
+                series_dropped.add_metric([account], self.series_dropped.get(account, 0))
+            yield series_dropped
 
-        if not vms:
+    def collect_vm_metrics(self, snapshots: List[Tuple[str, Snapshot]]):
+        """Collect per-VM metrics from the snapshot columns, one pass per family."""
+        if not any(len(snapshot.vms) for _, snapshot in snapshots):
             logger.warning("No VMs found")
             return
 
-        # Create metric families
+        label_names = ['account', self.vm_label_name]
+        info_label_names = label_names + (['hostname'] if self.vm_label != 'hostname' else [])
         vm_info = GaugeMetricFamily(
             'racknerd_vm_info',
             'Information about the VM',
-            labels=['hostname', 'ip_address', 'os', 'vm_type']
+            labels=info_label_names + list(self.info_labels)
         )
-
-        vm_state = GaugeMetricFamily(
-            'racknerd_vm_state',
-            'VM power state (1=online, 0=offline)',
-            labels=['hostname']
-        )
-
         vm_stats_up = GaugeMetricFamily(
             'racknerd_vm_stats_available',
             'Whether VM stats are available (1=available, 0=unavailable)',
-            labels=['hostname']
+            labels=label_names
         )
+        families = [GaugeMetricFamily(metric.name, metric.documentation, labels=label_names)
+                    for metric in STATS_METRICS]
+
+        for (account, snapshot), (rows, column_rows, _) in zip(snapshots, self.select(snapshots)):
+            vms = snapshot.vms
+            vm_labels, info_labels = self.labels(account, vms)
+            self.add_column(vm_info, info_labels, [1] * len(vms), rows)
+            self.add_column(vm_stats_up, vm_labels, snapshot.available, rows)
+            for family, column, selected in zip(families, snapshot.values, column_rows):
+                self.add_column(family, vm_labels, column, selected)
+
+            if not all(snapshot.available):
+                for hostname, available in zip(vms.hostnames, snapshot.available):
+                    if not available:
+                        logger.warning(f"Stats unavailable for VM {hostname}")
+
+        # racknerd_vm_state comes first in STATS_METRICS and is exported before
+        # the availability families
+        yield vm_info
+        yield families[0]
+        yield vm_stats_up
+        yield from families[1:]
 
-        # Bandwidth metrics
-        bandwidth_total = GaugeMetricFamily(
-            'racknerd_bandwidth_total_bytes',
-            'Total bandwidth allocation in bytes',
-            labels=['hostname']
-        )
+    def collect_fleet_metrics(self, snapshots: List[Tuple[str, Snapshot]]):
+        """Collect totals and usage quantiles per account, vm_type and os.
 
-        bandwidth_used = GaugeMetricFamily(
-            'racknerd_bandwidth_used_bytes',
-            'Used bandwidth in bytes',
-            labels=['hostname']
-        )
+        Computed from the snapshot columns, so dashboards can read a few
+        series instead of aggregating every per-VM series.
+        """
+        if not any(len(snapshot.vms) for _, snapshot in snapshots):
+            return
 
-        bandwidth_percent = GaugeMetricFamily(
-            'racknerd_bandwidth_usage_percent',
-            'Bandwidth usage percentage',
-            labels=['hostname']
+        labels = ['account', 'vm_type', 'os']
+        fleet_vms = GaugeMetricFamily(
+            'racknerd_fleet_vms',
+            'VMs in the VM list',
+            labels=labels
         )
-
-        # Disk metrics
-        disk_total = GaugeMetricFamily(
-            'racknerd_disk_total_bytes',
-            'Total disk space in bytes',
-            labels=['hostname']
+        fleet_online = GaugeMetricFamily(
+            'racknerd_fleet_vms_online',
+            'VMs reported online',
+            labels=labels
         )
+        # (family, column, whether to report quantiles) per summarized metric
+        fleet = []
+        for column, metric in FLEET_METRICS:
+            name = metric.name.replace('racknerd_', 'racknerd_fleet_', 1)
+            if metric.parser == 'percent':
+                family = GaugeMetricFamily(name, f'Quantiles of the {metric.documentation.lower()} of VMs',
+                                           labels=labels + ['quantile'])
+            else:
+                family = GaugeMetricFamily(name, f'{metric.documentation}, summed over VMs',
+                                           labels=labels)
+            fleet.append((family, column, metric.parser == 'percent'))
+
+        for account, snapshot in snapshots:
+            state = snapshot.values[STATE_COLUMN]
+            for (vm_type, os_name), rows in snapshot.vms.groups.items():
+                group_labels = [account, vm_type, os_name]
+                fleet_vms.add_metric(group_labels, len(rows))
+                fleet_online.add_metric(group_labels, sum(1 for row in rows if state[row] == 1))
+                for family, column, quantiles in fleet:
+                    values = snapshot.values[column]
+                    # VMs without stats, or not reporting the group, are NaN
+                    reported = [value for value in map(values.__getitem__, rows) if value == value]
+                    if not reported:
+                        continue
+                    if not quantiles:
+                        family.add_metric(group_labels, math.fsum(reported))
+                        continue
+                    reported.sort()
+                    for q in FLEET_QUANTILES:
+                        family.add_metric(group_labels + [str(q)], quantile(reported, q))
+
+        yield fleet_vms
+        yield fleet_online
+        for family, _, _ in fleet:
+            yield family
+
+
+class ScrapeMiddleware:
+    """WSGI middleware around the metrics app.
+
+    The X-Prometheus-Scrape-Timeout-Seconds header minus a safety margin is
+    made available to collectors on the serving thread via scrape_deadline().
+    Scrapes shed with ScrapeOverloaded are answered with 503.
+    """
+
+    def __init__(self, app, margin: float = 0.5):
+        self.app = app
+        self.margin = margin
+
+    def __call__(self, environ, start_response):
+        deadline = None
+        timeout = environ.get('HTTP_X_PROMETHEUS_SCRAPE_TIMEOUT_SECONDS')
+        if timeout:
+            try:
+                deadline = time.time() + float(timeout) - self.margin
+            except ValueError:
+                logger.debug(f"Ignoring invalid scrape timeout header: {timeout}")
 
-        disk_used = GaugeMetricFamily(
-            'racknerd_disk_used_bytes',
-            'Used disk space in bytes',
-            labels=['hostname']
-        )
+        _scrape.deadline = deadline
+        try:
+            return self.app(environ, start_response)
+        except ScrapeOverloaded as e:
+            logger.warning(f"Rejecting scrape: {e}")
+            start_response('503 Service Unavailable', [('Content-Type', 'text/plain')])
+            return [b'Too many scrapes waiting for a refresh\n']
+        finally:
+            _scrape.deadline = None
 
-        disk_percent = GaugeMetricFamily(
-            'racknerd_disk_usage_percent',
-            'Disk usage percentage',
-            labels=['hostname']
-        )
 
-        # Memory metrics
-        memory_total = GaugeMetricFamily(
-            'racknerd_memory_total_bytes',
-            'Total memory in bytes',
-            labels=['hostname']
-        )
+class ProbeResultCollector:
+    """Collector yielding the blackbox-style result of one probe."""
 
-        memory_used = GaugeMetricFamily(
-            'racknerd_memory_used_bytes',
-            'Used memory in bytes',
-            labels=['hostname']
-        )
+    def __init__(self, success: bool, duration: float):
+        self.success = success
+        self.duration = duration
 
-        memory_percent = GaugeMetricFamily(
-            'racknerd_memory_usage_percent',
-            'Memory usage percentage',
-            labels=['hostname']
+    def collect(self):
+        probe_success = GaugeMetricFamily(
+            'probe_success',
+            'Whether the account\'s VM stats are being fetched from the panel'
         )
+        probe_success.add_metric([], 1 if self.success else 0)
 
-        # VSwap metrics
-        vswap_total = GaugeMetricFamily(
-            'racknerd_vswap_total_bytes',
-            'Total vswap in bytes',
-            labels=['hostname']
+        probe_duration = GaugeMetricFamily(
+            'probe_duration_seconds',
+            'How long the probe took to complete in seconds'
         )
+        probe_duration.add_metric([], self.duration)
 
-        vswap_used = GaugeMetricFamily(
-            'racknerd_vswap_used_bytes',
-            'Used vswap in bytes',
-            labels=['hostname']
-        )
+        yield probe_success
+        yield probe_duration
 
-        vswap_percent = GaugeMetricFamily(
-            'racknerd_vswap_usage_percent',
-            'VSwap usage percentage',
-            labels=['hostname']
-        )
 
-        # Collect stats for each VM
-        for vm in vms:
-            vm_id = vm['vm_id']
-            hostname = vm['hostname']
+class ProbeApp:
+    """WSGI app serving /probe?account=<name> for one account at a time.
 
-            # Add VM info
-            vm_info.add_metric(
-                [hostname, vm['ip_address'], vm['os'], vm['vm_type']],
-                1
-            )
+    Lets Prometheus scrape each account as its own target, in the style of
+    blackbox_exporter. Probes reuse the accounts' logged-in pollers.
+    """
+
+    def __init__(self, pollers: Dict[str, RackNerdPoller], **collector_options):
+        self.pollers = pollers
+        self.registries = {}
+        for name, poller in pollers.items():
+            registry = CollectorRegistry()
+            registry.register(RackNerdCollector({name: poller}, **collector_options))
+            self.registries[name] = registry
+
+    def __call__(self, environ, start_response):
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        account = query.get('account', [''])[0]
+        if account not in self.registries:
+            start_response('400 Bad Request', [('Content-Type', 'text/plain')])
+            return [f'Unknown account "{account}"\n'.encode()]
+
+        poller = self.pollers[account]
+        start = time.time()
+        output = generate_latest(self.registries[account])
+        duration = time.time() - start
+
+        result = CollectorRegistry()
+        result.register(ProbeResultCollector(poller.healthy(start), duration))
+        output += generate_latest(result)
+
+        start_response('200 OK', [('Content-Type', CONTENT_TYPE_LATEST)])
+        return [output]
 
-            # Get detailed stats
-            stats = self.client.get_vm_stats(vm_id)
-
-            if stats:
-                # VM stats are available
-                vm_stats_up.add_metric([hostname], 1)
-
-                # VM State (power state)
-                state_value = stats.get('state', '0')
-                try:
-                    state = int(state_value)
-                except (ValueError, TypeError):
-                    state = 0
-                vm_state.add_metric([hostname], state)
-
-                logger.debug(f"VM {hostname} state: {state} ({'online' if state == 1 else 'offline'})")
-
-                # Bandwidth
-                if stats.get('totalbw'):
-                    bandwidth_total.add_metric([hostname], self.parse_size(stats['totalbw']))
-                    bandwidth_used.add_metric([hostname], self.parse_size(stats.get('usedbw', '0')))
-                    bandwidth_percent.add_metric([hostname], float(stats.get('percentbw', '0')))
-
-                # Disk
-                if stats.get('totalhdd'):
-                    disk_total.add_metric([hostname], self.parse_size(stats['totalhdd']))
-                    disk_used.add_metric([hostname], self.parse_size(stats.get('usedhdd', '0')))
-                    disk_percent.add_metric([hostname], float(stats.get('percenthdd', '0')))
-
-                # Memory
-                if stats.get('totalmem') and stats['totalmem'] not in ['null', None]:
-                    memory_total.add_metric([hostname], self.parse_size(stats['totalmem']))
-                    memory_used.add_metric([hostname], self.parse_size(stats.get('usedmem', '0')))
-                    memory_percent.add_metric([hostname], float(stats.get('percentmem', '0')))
-
-                # VSwap
-                if stats.get('totalvswap') and stats['totalvswap'] not in ['null', None]:
-                    vswap_total.add_metric([hostname], self.parse_size(stats['totalvswap']))
-                    vswap_used.add_metric([hostname], self.parse_size(stats.get('usedvswap', '0')))
-                    vswap_percent.add_metric([hostname], float(stats.get('percentvswap', '0')))
+
+class SnapshotFamilies(NamedTuple):
+    """The per-VM and fleet families of given snapshots, for rendering on their own."""
+
+    collector: 'RackNerdCollector'
+    snapshots: List[Tuple[str, Snapshot]]
+
+    def collect(self):
+        return self.collector.collect_snapshot_metrics(self.snapshots)
+
+
+class NamedFamilies(NamedTuple):
+    """The samples of a registry with the given names, for name[] filtered scrapes.
+
+    Stands in for CollectorRegistry.restricted_registry(), which only finds
+    collectors by the names they describe, and RackNerdCollector describes none.
+    """
+
+    registry: CollectorRegistry
+    names: Set[str]
+
+    def collect(self):
+        for family in self.registry.collect():
+            samples = [sample for sample in family.samples if sample.name in self.names]
+            if samples:
+                metric = Metric(family.name, family.documentation, family.type, family.unit)
+                metric.samples = samples
+                yield metric
+
+
+class MetricsApp:
+    """WSGI app serving /metrics with the per-VM and fleet families cached.
+
+    When every account is polled in the background, the per-VM and fleet
+    families only change when a poller publishes a snapshot. They are
+    rendered on the first scrape after that, per content type (text or
+    OpenMetrics, from Accept) and compression (from Accept-Encoding), and
+    reused until the next snapshot. Everything else, such as stats ages,
+    the exporter's own metrics and the process metrics, is rendered on every
+    scrape and appended; gzipped bodies are two gzip members. Without
+    background polling every scrape refreshes the data, so all of it is
+    rendered as usual, as are name[] filtered scrapes, which hold only the
+    samples asked for.
+    """
+
+    def __init__(self, registry: CollectorRegistry, collector: 'RackNerdCollector'):
+        self.registry = registry
+        self.collector = collector
+        self.uncached_app = make_wsgi_app(registry)
+        # Snapshots the cached outputs were rendered from
+        self.snapshots: Optional[Tuple[Snapshot, ...]] = None
+        # (content type, gzipped) -> snapshot families of the body
+        self.outputs: Dict[Tuple[str, bool], bytes] = {}
+        # Scrapes served from, and renders into, the cache
+        self.hits = 0
+        self.renders = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if (environ.get('REQUEST_METHOD', 'GET') != 'GET'
+                or environ.get('PATH_INFO') == '/favicon.ico'):
+            return self.uncached_app(environ, start_response)
+
+        encoder, content_type = choose_encoder(environ.get('HTTP_ACCEPT'))
+        gzipped = gzip_accepted(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        names = parse_qs(environ.get('QUERY_STRING', '')).get('name[]')
+        if names:
+            output = encoder(NamedFamilies(self.registry, set(names)))
+            return self.respond(start_response, gzip.compress(output) if gzipped else output,
+                                content_type, gzipped)
+        if not all(poller.interval > 0 for poller in self.collector.pollers.values()):
+            output = encoder(self.registry)
+            return self.respond(start_response, gzip.compress(output) if gzipped else output,
+                                content_type, gzipped)
+
+        snapshots = self.collector.get_snapshots()
+        cached = self.snapshot_output(snapshots, encoder, content_type, gzipped)
+
+        _scrape.cached_snapshots = snapshots
+        try:
+            live = encoder(self.registry)
+        finally:
+            _scrape.cached_snapshots = None
+        return self.respond(start_response, cached + (gzip.compress(live) if gzipped else live),
+                            content_type, gzipped)
+
+    @staticmethod
+    def respond(start_response, output: bytes, content_type: str, gzipped: bool):
+        headers = [('Content-Type', content_type), ('Content-Length', str(len(output)))]
+        if gzipped:
+            headers.append(('Content-Encoding', 'gzip'))
+        start_response('200 OK', headers)
+        return [output]
+
+    def snapshot_output(self, snapshots: List[Tuple[str, Snapshot]], encoder,
+                        content_type: str, gzipped: bool) -> bytes:
+        """Return the rendered snapshot families, rendering them if a snapshot changed."""
+        key = tuple(snapshot for _, snapshot in snapshots)
+        with self._lock:
+            if (self.snapshots is None or len(key) != len(self.snapshots)
+                    or any(a is not b for a, b in zip(key, self.snapshots))):
+                self.snapshots = key
+                self.outputs = {}
+
+            output = self.outputs.get((content_type, gzipped))
+            if output is not None:
+                self.hits += 1
+                return output
+            output = self.outputs.get((content_type, False))
+            if output is None:
+                self.renders += 1
+                output = encoder(SnapshotFamilies(self.collector, snapshots))
+                # The live part that follows ends the OpenMetrics body
+                if output.endswith(b'# EOF\n'):
+                    output = output[:-len(b'# EOF\n')]
+                self.outputs[(content_type, False)] = output
             else:
-                # No stats available
-                vm_stats_up.add_metric([hostname], 0)
-                # Set state to offline when stats unavailable
-                vm_state.add_metric([hostname], 0)
-                logger.warning(f"Stats unavailable for VM {hostname}")
+                self.hits += 1
+            if gzipped:
+                output = self.outputs[(content_type, True)] = gzip.compress(output)
+            return output
 
-        # Yield all metrics
-        yield vm_info
-        yield vm_state
-        yield vm_stats_up
-        yield bandwidth_total
-        yield bandwidth_used
-        yield bandwidth_percent
-        yield disk_total
-        yield disk_used
-        yield disk_percent
-        yield memory_total
-        yield memory_used
-        yield memory_percent
-        yield vswap_total
-        yield vswap_used
-        yield vswap_percent
+
+class ExporterApp:
+    """WSGI app routing /probe to ProbeApp and everything else to /metrics.
+
+    POST /-/refresh-inventory[?account=<name>] drops the cached VM lists so
+    the next refresh fetches them from the panel.
+    """
+
+    def __init__(self, metrics_app, probe_app: ProbeApp, pollers: Dict[str, RackNerdPoller]):
+        self.metrics_app = metrics_app
+        self.probe_app = probe_app
+        self.pollers = pollers
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO')
+        if path == '/probe':
+            return self.probe_app(environ, start_response)
+        if path == '/-/refresh-inventory':
+            return self.refresh_inventory(environ, start_response)
+        return self.metrics_app(environ, start_response)
+
+    def refresh_inventory(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') != 'POST':
+            start_response('405 Method Not Allowed', [('Content-Type', 'text/plain'),
+                                                      ('Allow', 'POST')])
+            return [b'Use POST\n']
+
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        accounts = query.get('account') or list(self.pollers)
+        unknown = [account for account in accounts if account not in self.pollers]
+        if unknown:
+            start_response('400 Bad Request', [('Content-Type', 'text/plain')])
+            return [f'Unknown account "{unknown[0]}"\n'.encode()]
+
+        for account in accounts:
+            self.pollers[account].inventory.invalidate("refresh requested")
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [f'VM list will be refreshed for {", ".join(accounts)}\n'.encode()]
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """WSGI server handling each request on its own thread."""
+
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    """Request handler that does not log every request."""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int, app) -> WSGIServer:
+    """Serve a WSGI app on a background thread."""
+    httpd = make_server('', port, app, ThreadingWSGIServer, handler_class=QuietHandler)
+    threading.Thread(target=httpd.serve_forever, name='racknerd-http', daemon=True).start()
+    return httpd
+
+
+def load_accounts(path: str) -> List[Dict]:
+    """Load accounts from a YAML config file.
+
+    The file holds an "accounts" list; each entry needs username and
+    password and may set name, url, stats_concurrency, session_file,
+    schedule_file, inventory_ttl and stats_ttl.
+    Environment variables in values (e.g. ${RACKNERD_PASSWORD}) are expanded.
+    """
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+
+    accounts = []
+    for entry in config.get('accounts') or []:
+        account = {
+            key: os.path.expandvars(value) if isinstance(value, str) else value
+            for key, value in entry.items()
+        }
+        if not account.get('username') or not account.get('password'):
+            raise ValueError(f"Account {account.get('name', '?')} needs username and password")
+        account.setdefault('name', account['username'])
+        accounts.append(account)
+
+    names = [account['name'] for account in accounts]
+    if not names:
+        raise ValueError(f"No accounts configured in {path}")
+    if len(set(names)) != len(names):
+        raise ValueError("Account names must be unique")
+    return accounts
+
+
+def account_file(args, account: Dict, key: str) -> Optional[str]:
+    """Return an account's file setting, or the command line one.
+
+    With a config file the command line path is shared by all accounts, so
+    the account name is appended to keep their files apart.
+    """
+    if key in account:
+        return account[key]
+    path = getattr(args, key)
+    if path and args.config:
+        return f"{path}.{account['name']}"
+    return path
+
+
+def build_poller(args, account: Dict, rate_limiter: Optional[TokenBucket] = None,
+                 size_parser: Optional[SizeParser] = None,
+                 event_loop: Optional[EventLoopThread] = None) -> RackNerdPoller:
+    """Create the client and poller for one account.
+
+    Async pollers run on event_loop, or on their own if None.
+    """
+    url = account.get('url', args.url)
+    stats_concurrency = int(account.get('stats_concurrency', args.stats_concurrency))
+    session_file = account_file(args, account, 'session_file')
+    inventory_ttl = float(account.get('inventory_ttl', args.inventory_ttl))
+    stats_ttl = float(account.get('stats_ttl', args.stats_ttl))
+    schedule_file = account_file(args, account, 'schedule_file')
+    timeout = (args.connect_timeout, args.read_timeout)
+
+    if args.engine == 'async':
+        client = AsyncRackNerdClient(url, account['username'], account['password'],
+                                     pool_size=stats_concurrency, timeout=timeout,
+                                     session_file=session_file,
+                                     latency_target=args.latency_target,
+                                     rate_limiter=rate_limiter,
+                                     circuit=(args.circuit_failures, args.circuit_reset))
+        return AsyncRackNerdPoller(client, stats_concurrency, args.refresh_interval,
+                                   args.max_waiting_scrapes, inventory_ttl,
+                                   stats_ttl, schedule_file, args.max_stats_age,
+                                   size_parser, args.publish_interval, event_loop)
+
+    client = RackNerdClient(url, account['username'], account['password'],
+                            pool_size=stats_concurrency, timeout=timeout,
+                            session_file=session_file,
+                            latency_target=args.latency_target,
+                            rate_limiter=rate_limiter,
+                            circuit=(args.circuit_failures, args.circuit_reset))
+    return RackNerdPoller(client, stats_concurrency, args.refresh_interval,
+                          args.max_waiting_scrapes, inventory_ttl, stats_ttl,
+                          schedule_file, args.max_stats_age, size_parser,
+                          args.publish_interval)
 
 
 def main():
     parser = argparse.ArgumentParser(description='RackNerd Prometheus Exporter')
-    parser.add_argument('--url', required=True, help='RackNerd control panel URL')
-    parser.add_argument('--username', required=True, help='RackNerd username')
-    parser.add_argument('--password', required=True, help='RackNerd password')
+    parser.add_argument('--url', default='https://nerdvm.racknerd.com',
+                       help='RackNerd control panel URL (default: https://nerdvm.racknerd.com)')
+    parser.add_argument('--username', help='RackNerd username')
+    parser.add_argument('--password', help='RackNerd password')
+    parser.add_argument('--account-name',
+                       help='Value of the account label for --username (default: the username)')
+    parser.add_argument('--config',
+                       help='YAML file listing several accounts, used instead of '
+                            '--username/--password')
     parser.add_argument('--port', type=int, default=9100, help='Exporter port (default: 9100)')
+    parser.add_argument('--stats-concurrency', type=int, default=8,
+                       help='Most VM stats requests made in parallel; the actual number '
+                            'adapts to how the panel copes (default: 8)')
+    parser.add_argument('--latency-target', type=float, default=2.0,
+                       help='Panel response time in seconds below which concurrency may '
+                            'grow (default: 2)')
+    parser.add_argument('--max-request-rate', type=float, default=0,
+                       help='Most panel requests per second across all accounts; '
+                            '0 is unlimited (default: 0)')
+    parser.add_argument('--connect-timeout', type=float, default=5.0,
+                       help='Panel connect timeout in seconds (default: 5)')
+    parser.add_argument('--read-timeout', type=float, default=30.0,
+                       help='Panel read timeout in seconds (default: 30)')
+    parser.add_argument('--scrape-timeout-margin', type=float, default=0.5,
+                       help='Seconds kept free of the Prometheus scrape timeout for '
+                            'serialization (default: 0.5)')
+    parser.add_argument('--max-waiting-scrapes', type=int, default=10,
+                       help='Scrapes allowed to wait for a refresh in progress before '
+                            'further ones get 503 (default: 10)')
+    parser.add_argument('--session-file',
+                       help='File to save the panel session in, so restarts can reuse it '
+                            'instead of logging in')
+    parser.add_argument('--engine', default='sync', choices=['sync', 'async'],
+                       help='HTTP engine: sync (requests + threads) or async (aiohttp + asyncio)')
+    parser.add_argument('--refresh-interval', type=float, default=0,
+                       help='Seconds in which the background poller polls every VM once, '
+                            'spread evenly; 0 fetches on every scrape (default: 0)')
+    parser.add_argument('--publish-interval', type=float, default=15,
+                       help='Least seconds between snapshots of background polls; polls in '
+                            'between are published together (default: 15)')
+    parser.add_argument('--schedule-file',
+                       help='File to save the polled VM stats in, so a restart resumes the '
+                            'background poll schedule instead of polling every VM at once')
+    parser.add_argument('--inventory-ttl', type=float, default=3600,
+                       help='Seconds the VM list from home.php is cached before it is '
+                            'fetched again; 0 fetches it on every refresh (default: 3600)')
+    parser.add_argument('--stats-ttl', type=float, default=0,
+                       help='Seconds the stats of a VM are served from cache before they are '
+                            'fetched again; 0 fetches them on every refresh (default: 0)')
+    parser.add_argument('--circuit-failures', type=int, default=5,
+                       help='Consecutive failed requests to a panel endpoint before requests '
+                            'to it are stopped (default: 5)')
+    parser.add_argument('--circuit-reset', type=float, default=30,
+                       help='Seconds before a stopped endpoint is probed again; doubles while '
+                            'probes fail (default: 30)')
+    parser.add_argument('--max-stats-age', type=float, default=3600,
+                       help='Seconds the last good stats of a VM are served while they cannot '
+                            'be fetched (default: 3600)')
+    parser.add_argument('--top-k', type=int, default=0,
+                       help='Export per-VM series only for the K VMs with the highest usage '
+                            'percentage of each resource; 0 exports every VM (default: 0)')
+    parser.add_argument('--vm-info-labels', default=','.join(VM_INFO_LABELS),
+                       help='Comma separated labels of racknerd_vm_info besides account and '
+                            'hostname, from ip_address, os and vm_type '
+                            '(default: ip_address,os,vm_type)')
+    parser.add_argument('--vm-label', choices=sorted(VM_LABELS), default='hostname',
+                       help='Identify VMs in per-VM series by hostname, or by a short ID '
+                            'derived from the panel VM ID in a "vm" label (default: hostname)')
+    parser.add_argument('--max-series', type=int, default=0,
+                       help='Most per-VM series per scrape; VMs beyond it are left out and '
+                            'counted in racknerd_series_dropped_total. 0 is no cap (default: 0)')
+    parser.add_argument('--decimal-sizes', action='store_true',
+                       help='Read KB, MB, GB, TB and PB from the panel as powers of 1000 instead '
+                            'of 1024')
     parser.add_argument('--log-level', default='INFO',
                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
                        help='Logging level')
@@ -464,28 +3032,91 @@ def main():
     # Set logging level
     logger.setLevel(getattr(logging, args.log_level))
 
-    # Create client and collector
-    client = RackNerdClient(args.url, args.username, args.password)
+    if args.config:
+        try:
+            accounts = load_accounts(args.config)
+        except (OSError, ValueError, yaml.YAMLError) as e:
+            logger.error(f"Invalid config file {args.config}: {e}")
+            return 1
+    elif args.username and args.password:
+        accounts = [{
+            'name': args.account_name or args.username,
+            'username': args.username,
+            'password': args.password,
+        }]
+    else:
+        parser.error("either --config or --username and --password are required")
+    if args.top_k < 0:
+        parser.error("--top-k must not be negative")
+    if args.max_series < 0:
+        parser.error("--max-series must not be negative")
+    try:
+        info_labels = parse_vm_info_labels(args.vm_info_labels)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Create a client and poller per account
+    # One rate limit for the whole exporter, as all accounts share the panel
+    rate_limiter = TokenBucket(args.max_request_rate) if args.max_request_rate > 0 else None
+    # Accounts share the parsed sizes, as they see the same strings
+    size_parser = SizeParser(decimal=args.decimal_sizes)
+    # The async engine runs every account on one event loop
+    event_loop = EventLoopThread() if args.engine == 'async' else None
+    try:
+        pollers = {account['name']: build_poller(args, account, rate_limiter, size_parser,
+                                                 event_loop)
+                   for account in accounts}
+    except ValueError as e:
+        logger.error(f"Invalid configuration: {e}")
+        return 1
 
-    # Test login
-    if not client.login():
+    # Reuse saved sessions where there are any, otherwise test login
+    failed = []
+    for name, poller in pollers.items():
+        if poller.restore_session():
+            logger.info(f"Restored session for account {name}")
+        elif not poller.login():
+            logger.error(f"Failed to login to RackNerd account {name}")
+            failed.append(name)
+    if len(failed) == len(pollers):
         logger.error("Failed to login to RackNerd. Exiting.")
         return 1
 
     # Register collector
-    REGISTRY.register(RackNerdCollector(client))
+    collector_options = {
+        'top_k': args.top_k,
+        'info_labels': info_labels,
+        'vm_label': args.vm_label,
+        'max_series': args.max_series,
+    }
+    # Start polling first, so the saved schedule is loaded before any scrape
+    if args.refresh_interval > 0:
+        for poller in pollers.values():
+            poller.start()
+    collector = RackNerdCollector(pollers, **collector_options)
+    REGISTRY.register(collector)
 
     # Start HTTP server
-    start_http_server(args.port)
+    app = ExporterApp(MetricsApp(REGISTRY, collector), ProbeApp(pollers, **collector_options), pollers)
+    start_http_server(args.port, ScrapeMiddleware(app, args.scrape_timeout_margin))
     logger.info(f"RackNerd exporter started on port {args.port}")
 
-    # Keep running
+    # Keep running until interrupted or terminated
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
     try:
-        while True:
-            time.sleep(1)
+        while not stopping.is_set():
+            stopping.wait(1)
     except KeyboardInterrupt:
-        logger.info("Exporter stopped")
-        return 0
+        pass
+
+    # Save the schedules, so a restart resumes them
+    if args.refresh_interval > 0:
+        for poller in pollers.values():
+            poller.stop()
+            poller.save_schedule()
+    logger.info("Exporter stopped")
+    return 0
 
 
 if __name__ == '__main__':
@@ -0,0 +1,20 @@
+"""Fake clock for tests of time-dependent state."""
+
+from unittest import mock
+
+
+class FakeClock:
+    """Stands in for time.time, moved forward by hand."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def patch(self, test):
+        """Patch time.time for the duration of a unittest test."""
+        patcher = mock.patch('time.time', self)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+        return self
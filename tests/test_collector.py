@@ -0,0 +1,178 @@
+"""
+Tests of scrapes through the collector and MetricsApp against the fake panel.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+
+import gzip
+import logging
+import os
+import sys
+import threading
+import time
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from fake_panel import FakePanel  # noqa: E402
+from prometheus_client import CollectorRegistry  # noqa: E402
+from prometheus_client.parser import text_string_to_metric_families  # noqa: E402
+import racknerd_exporter as exporter  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+
+class ConcurrentScrapeTest(unittest.TestCase):
+    """Scrapes arriving during an on-demand refresh share it or are shed."""
+
+    def start_poller(self, vm_count: int = 8, max_waiting: int = 1) -> exporter.RackNerdPoller:
+        panel = FakePanel(vm_count, latency=0.25).start()
+        self.addCleanup(panel.stop)
+        self.panels.append(panel)
+        client = exporter.RackNerdClient(panel.url, 'user', 'pass')
+        poller = exporter.RackNerdPoller(client, vm_count, max_waiting_scrapes=max_waiting)
+        poller.login()
+        panel.reset_counts()
+        return poller
+
+    def setUp(self):
+        self.panels = []
+
+    def scrape(self, collector: exporter.RackNerdCollector, count: int):
+        """Collect from count threads at once; returns the number shed."""
+        shed = []
+
+        def collect():
+            try:
+                list(collector.collect())
+            except exporter.ScrapeOverloaded:
+                shed.append(1)
+
+        threads = [threading.Thread(target=collect) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+            # Let the first scrape start the refresh before the others arrive
+            time.sleep(0.02)
+        for thread in threads:
+            thread.join(10)
+        return len(shed)
+
+    def test_single_account_scrapes_are_coalesced_and_shed(self):
+        poller = self.start_poller()
+        collector = exporter.RackNerdCollector({'main': poller})
+
+        self.assertEqual(self.scrape(collector, 5), 3)
+        self.assertEqual(poller.single_flight.coalesced, 1)
+        self.assertEqual(poller.single_flight.shed, 3)
+        self.assertEqual(self.panels[0].requests.get('/_vm_remote.php'), 8)
+
+    def test_every_account_coalesces_its_own_scrapes(self):
+        pollers = {'a': self.start_poller(max_waiting=4), 'b': self.start_poller(max_waiting=4)}
+        collector = exporter.RackNerdCollector(pollers)
+
+        self.assertEqual(self.scrape(collector, 5), 0)
+        for poller, panel in zip(pollers.values(), self.panels):
+            self.assertEqual(poller.single_flight.coalesced, 4)
+            self.assertEqual(panel.requests.get('/_vm_remote.php'), 8)
+
+    def test_probes_are_coalesced_per_account(self):
+        poller = self.start_poller(max_waiting=4)
+        app = exporter.ProbeApp({'main': poller})
+        environ = {'QUERY_STRING': 'account=main', 'PATH_INFO': '/probe'}
+
+        threads = [threading.Thread(target=app, args=(environ, lambda *args: None))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.02)
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(poller.single_flight.coalesced, 2)
+        self.assertEqual(self.panels[0].requests.get('/_vm_remote.php'), 8)
+
+
+class MetricsAppTest(unittest.TestCase):
+    """The per-VM and fleet families cached per snapshot, the rest rendered live."""
+
+    def setUp(self):
+        panel = FakePanel(5).start()
+        self.addCleanup(panel.stop)
+        client = exporter.RackNerdClient(panel.url, 'user', 'pass')
+        self.poller = exporter.RackNerdPoller(client, 4, interval=3600)
+        self.poller.login()
+        self.poller.start()
+        self.addCleanup(self.poller.stop)
+        deadline = time.time() + 10
+        while time.time() < deadline and (self.poller.snapshot is None
+                                          or not all(self.poller.snapshot.available)):
+            time.sleep(0.02)
+
+        self.registry = CollectorRegistry()
+        self.collector = exporter.RackNerdCollector({'main': self.poller})
+        self.registry.register(self.collector)
+        self.app = exporter.MetricsApp(self.registry, self.collector)
+
+    def scrape(self, accept: str = '', encoding: str = 'identity', query: str = '') -> bytes:
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/metrics', 'QUERY_STRING': query,
+                   'HTTP_ACCEPT': accept, 'HTTP_ACCEPT_ENCODING': encoding}
+        return b''.join(self.app(environ, lambda status, headers: None))
+
+    def samples(self, body: bytes):
+        """{(sample name, labels)} of a text body."""
+        return {(sample.name, tuple(sorted(sample.labels.items())))
+                for family in text_string_to_metric_families(body.decode())
+                for sample in family.samples}
+
+    def value(self, body: bytes, name: str) -> float:
+        for family in text_string_to_metric_families(body.decode()):
+            for sample in family.samples:
+                if sample.name == name:
+                    return sample.value
+        raise KeyError(name)
+
+    def test_body_has_the_same_series_as_an_uncached_scrape(self):
+        # The serialize stage duration is only exported once a scrape was serialized
+        self.scrape()
+        cached = self.scrape()
+        self.assertEqual(self.samples(cached), self.samples(exporter.generate_latest(self.registry)))
+        self.assertIn('racknerd_vm_state', {name for name, _ in self.samples(cached)})
+        self.assertIn('racknerd_vm_stats_age_seconds', {name for name, _ in self.samples(cached)})
+
+    def test_snapshot_families_are_rendered_once_per_snapshot(self):
+        self.scrape()
+        self.scrape()
+        self.assertEqual((self.app.renders, self.app.hits), (1, 1))
+
+        self.poller.publish(0.0)
+        self.scrape()
+        self.assertEqual((self.app.renders, self.app.hits), (2, 1))
+
+    def test_time_dependent_values_are_rendered_every_scrape(self):
+        first = self.value(self.scrape(), 'racknerd_snapshot_age_seconds')
+        time.sleep(0.05)
+        second = self.value(self.scrape(), 'racknerd_snapshot_age_seconds')
+        self.assertEqual(self.app.renders, 1)
+        self.assertGreater(second, first)
+
+    def test_openmetrics_body_ends_with_a_single_eof(self):
+        body = self.scrape(accept='application/openmetrics-text; version=1.0.0')
+        self.assertTrue(body.endswith(b'# EOF\n'))
+        self.assertEqual(body.count(b'# EOF'), 1)
+
+    def test_gzip_body_holds_both_parts(self):
+        self.scrape()
+        body = gzip.decompress(self.scrape(encoding='gzip'))
+        self.assertEqual(self.samples(body), self.samples(self.scrape()))
+
+    def test_name_filtered_scrapes_bypass_the_cache(self):
+        body = self.scrape(query='name[]=racknerd_vm_state&name[]=racknerd_fleet_vms')
+        self.assertEqual({name for name, _ in self.samples(body)},
+                         {'racknerd_vm_state', 'racknerd_fleet_vms'})
+        self.assertEqual(len([name for name, _ in self.samples(body) if name == 'racknerd_vm_state']), 5)
+        self.assertEqual(self.app.renders, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,233 @@
+"""
+Tests of the circuit breaker, scrape coalescing and login backoff.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from clock import FakeClock  # noqa: E402
+import racknerd_exporter as exporter  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock().patch(self)
+        self.breaker = exporter.CircuitBreaker(failure_threshold=3, reset_timeout=30.0,
+                                               max_reset_timeout=100.0)
+
+    def fail(self, times: int):
+        for _ in range(times):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(False)
+
+    def open_and_wait(self):
+        """Open the circuit and let its reset timeout pass."""
+        self.fail(3)
+        self.clock.now += self.breaker.timeout
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail(2)
+        self.assertEqual(self.breaker.state, 'closed')
+        self.fail(1)
+        self.assertEqual(self.breaker.state, 'open')
+
+        self.assertFalse(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.rejected, 2)
+
+    def test_success_resets_the_failure_count(self):
+        self.fail(2)
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(True)
+        self.fail(2)
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_stays_open_until_the_reset_timeout(self):
+        self.fail(3)
+        self.clock.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.state, 'open')
+
+    def test_half_open_lets_a_single_probe_through(self):
+        self.open_and_wait()
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, 'half_open')
+        self.assertFalse(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.rejected, 2)
+
+    def test_successful_probe_closes_the_circuit(self):
+        self.open_and_wait()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertEqual(self.breaker.failures, 0)
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_reopens_for_twice_as_long(self):
+        self.open_and_wait()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(False)
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertEqual(self.breaker.timeout, 60.0)
+
+        self.clock.now += 59
+        self.assertFalse(self.breaker.allow())
+        self.clock.now += 1
+        self.assertTrue(self.breaker.allow())
+
+    def test_reset_timeout_doubles_up_to_the_maximum(self):
+        self.fail(3)
+        timeouts = []
+        for _ in range(4):
+            self.clock.now += self.breaker.timeout
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(False)
+            timeouts.append(self.breaker.timeout)
+        self.assertEqual(timeouts, [60.0, 100.0, 100.0, 100.0])
+
+    def test_closing_restores_the_initial_reset_timeout(self):
+        self.open_and_wait()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(False)
+        self.clock.now += self.breaker.timeout
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(True)
+
+        self.open_and_wait()
+        self.assertEqual(self.breaker.timeout, 30.0)
+
+    def test_cancelled_probe_frees_the_probe_slot(self):
+        self.open_and_wait()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.cancel()
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+
+class SingleFlightTest(unittest.TestCase):
+    """SingleFlight with real threads: a leader blocked until released."""
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow_call(self, result):
+        self.calls += 1
+        self.release.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def start(self, flight, result, count: int):
+        """Start count callers of flight.do; returns their outcomes by index."""
+        outcomes = {}
+
+        def call(index):
+            try:
+                outcomes[index] = flight.do(self.slow_call, result)
+            except Exception as e:
+                outcomes[index] = e
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+            # Let each caller join before the next, so the first one leads
+            time.sleep(0.02)
+        return threads, outcomes
+
+    def finish(self, threads):
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = exporter.SingleFlight(max_waiting=10)
+        threads, outcomes = self.start(flight, 'snapshot', 4)
+        self.assertEqual(flight.waiting, 3)
+        self.finish(threads)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(outcomes, {i: 'snapshot' for i in range(4)})
+        self.assertEqual(flight.coalesced, 3)
+        self.assertEqual(flight.waiting, 0)
+
+    def test_callers_beyond_max_waiting_are_shed(self):
+        flight = exporter.SingleFlight(max_waiting=2)
+        threads, outcomes = self.start(flight, 'snapshot', 3)
+        self.assertEqual(flight.waiting, 2)
+
+        with self.assertRaises(exporter.ScrapeOverloaded):
+            flight.do(self.slow_call, 'snapshot')
+        self.assertEqual(flight.shed, 1)
+
+        self.finish(threads)
+        self.assertEqual(outcomes, {i: 'snapshot' for i in range(3)})
+
+    def test_errors_reach_every_waiting_caller(self):
+        flight = exporter.SingleFlight()
+        error = RuntimeError('panel down')
+        threads, outcomes = self.start(flight, error, 3)
+        self.finish(threads)
+        self.assertEqual(outcomes, {i: error for i in range(3)})
+
+    def test_next_call_after_completion_runs_again(self):
+        flight = exporter.SingleFlight()
+        self.release.set()
+        flight.do(self.slow_call, 1)
+        flight.do(self.slow_call, 2)
+        self.assertEqual(self.calls, 2)
+
+
+class LoginBackoffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock().patch(self)
+        self.backoff = exporter.LoginBackoff(base=30.0, maximum=200.0)
+
+    def test_allowed_before_any_failure(self):
+        self.assertTrue(self.backoff.allowed())
+        self.assertEqual(self.backoff.remaining(), 0.0)
+
+    def test_delay_doubles_per_failure_up_to_the_maximum(self):
+        delays = []
+        for _ in range(5):
+            self.backoff.record(False)
+            delays.append(self.backoff.remaining())
+        self.assertEqual(delays, [30.0, 60.0, 120.0, 200.0, 200.0])
+        self.assertEqual(self.backoff.failures, 5)
+
+    def test_refuses_attempts_until_the_delay_has_passed(self):
+        self.backoff.record(False)
+        self.assertFalse(self.backoff.allowed())
+        self.clock.now += 29
+        self.assertFalse(self.backoff.allowed())
+        self.clock.now += 1
+        self.assertTrue(self.backoff.allowed())
+
+    def test_success_resets_the_backoff(self):
+        for _ in range(3):
+            self.backoff.record(False)
+        self.clock.now += self.backoff.remaining()
+        self.backoff.record(True)
+        self.assertEqual(self.backoff.failures, 0)
+        self.assertTrue(self.backoff.allowed())
+
+        self.backoff.record(False)
+        self.assertEqual(self.backoff.remaining(), 30.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+"""
+Tests of the adaptive concurrency limiters.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from clock import FakeClock  # noqa: E402
+import racknerd_exporter as exporter  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock().patch(self)
+        self.limiter = exporter.AdaptiveLimiter(16, latency_target=2.0)
+
+    def test_starts_at_half_the_maximum(self):
+        self.assertEqual(self.limiter.limit, 8)
+
+    def test_fast_healthy_responses_grow_the_limit_by_one_per_round(self):
+        for _ in range(8):
+            self.limiter.acquire()
+            self.limiter.release(self.clock.now, 0.1)
+        self.assertAlmostEqual(self.limiter.limit, 9, delta=0.1)
+
+    def test_slow_healthy_responses_keep_the_limit(self):
+        self.limiter.acquire()
+        self.limiter.release(self.clock.now, 2.5)
+        self.assertEqual(self.limiter.limit, 8)
+
+    def test_limit_never_exceeds_the_maximum(self):
+        limiter = exporter.AdaptiveLimiter(2)
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release(self.clock.now, 0.1)
+        self.assertEqual(limiter.limit, 2)
+
+    def test_throttling_halves_the_limit_once_per_round(self):
+        started = self.clock.now
+        for _ in range(3):
+            self.limiter.acquire()
+
+        self.clock.now += 1
+        self.limiter.release(started, 1.0, 'timeout')
+        self.assertEqual(self.limiter.limit, 4)
+
+        # Requests sent before the decrease report the same congestion
+        self.limiter.release(started, 1.0, 'server_error')
+        self.limiter.release(started, 1.0, 'rate_limited')
+        self.assertEqual(self.limiter.limit, 4)
+        self.assertEqual(self.limiter.throttles,
+                         {'timeout': 1, 'server_error': 1, 'rate_limited': 1})
+
+        # A request sent after it is a new round
+        self.clock.now += 1
+        self.limiter.acquire()
+        self.limiter.release(self.clock.now, 0.5, 'error')
+        self.assertEqual(self.limiter.limit, 2)
+
+    def test_limit_never_drops_below_the_minimum(self):
+        limiter = exporter.AdaptiveLimiter(16, minimum=3)
+        for _ in range(5):
+            self.clock.now += 1
+            limiter.acquire()
+            limiter.release(self.clock.now, 0.5, 'error')
+        self.assertEqual(limiter.limit, 3)
+
+    def test_retry_after_pauses_new_requests(self):
+        self.limiter.acquire()
+        self.limiter.release(self.clock.now, 0.1, 'retry_after', retry_after=30.0)
+        self.assertEqual(self.limiter.pause_remaining(), 30.0)
+
+        self.clock.now += 29
+        self.assertEqual(self.limiter.pause_remaining(), 1.0)
+        self.clock.now += 1
+        self.assertEqual(self.limiter.pause_remaining(), 0.0)
+
+    def test_retry_after_keeps_the_later_pause(self):
+        self.limiter.acquire()
+        self.limiter.acquire()
+        self.limiter.release(self.clock.now, 0.1, 'retry_after', retry_after=30.0)
+        self.limiter.release(self.clock.now, 0.1, 'retry_after', retry_after=5.0)
+        self.assertEqual(self.limiter.pause_remaining(), 30.0)
+
+
+class AdaptiveLimiterBlockingTest(unittest.TestCase):
+    """acquire() with real threads and time."""
+
+    def test_acquire_waits_for_a_release_at_the_limit(self):
+        limiter = exporter.AdaptiveLimiter(2)
+        self.assertEqual(limiter.limit, 1)
+        limiter.acquire()
+
+        acquired = threading.Event()
+        waiter = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+        waiter.start()
+        self.assertFalse(acquired.wait(0.2))
+
+        limiter.release(time.time(), 0.1)
+        self.assertTrue(acquired.wait(2))
+        waiter.join()
+        self.assertEqual(limiter.in_flight, 1)
+
+    def test_acquire_waits_out_a_retry_after_pause(self):
+        limiter = exporter.AdaptiveLimiter(4)
+        limiter.acquire()
+        limiter.release(time.time(), 0.1, 'retry_after', retry_after=0.3)
+
+        start = time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+
+class AsyncAdaptiveLimiterTest(unittest.TestCase):
+
+    def test_acquire_waits_for_a_release_at_the_limit(self):
+        async def scenario():
+            limiter = exporter.AsyncAdaptiveLimiter(2)
+            await limiter.acquire()
+            waiter = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiter.done())
+
+            limiter.release(time.time(), 0.1)
+            await asyncio.wait_for(waiter, 1)
+            self.assertEqual(limiter.in_flight, 1)
+
+        asyncio.run(scenario())
+
+    def test_throttling_halves_the_limit_once_per_round(self):
+        async def scenario():
+            limiter = exporter.AsyncAdaptiveLimiter(16)
+            started = time.time()
+            for _ in range(3):
+                await limiter.acquire()
+            await asyncio.sleep(0.01)
+            for _ in range(3):
+                limiter.release(started, 1.0, 'timeout')
+            self.assertEqual(limiter.limit, 4)
+            self.assertEqual(limiter.throttles, {'timeout': 3})
+
+        asyncio.run(scenario())
+
+    def test_abandon_frees_the_slot_without_judging_the_panel(self):
+        async def scenario():
+            limiter = exporter.AsyncAdaptiveLimiter(16)
+            await limiter.acquire()
+            limiter.abandon()
+            self.assertEqual(limiter.in_flight, 0)
+            self.assertEqual(limiter.limit, 8)
+            self.assertEqual(limiter.throttles, {})
+
+        asyncio.run(scenario())
+
+    def test_acquire_waits_out_a_retry_after_pause(self):
+        async def scenario():
+            limiter = exporter.AsyncAdaptiveLimiter(4)
+            await limiter.acquire()
+            limiter.release(time.time(), 0.1, 'retry_after', retry_after=0.3)
+
+            start = time.monotonic()
+            await limiter.acquire()
+            self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+        asyncio.run(scenario())
+
+
+class ThrottleReasonTest(unittest.TestCase):
+
+    def test_reasons(self):
+        self.assertEqual(exporter.throttle_reason(None, error=exporter.requests.Timeout()), 'timeout')
+        self.assertEqual(exporter.throttle_reason(None, error=ConnectionError()), 'error')
+        self.assertEqual(exporter.throttle_reason(429), 'rate_limited')
+        self.assertEqual(exporter.throttle_reason(503), 'server_error')
+        self.assertEqual(exporter.throttle_reason(200, retry_after=5.0), 'retry_after')
+        self.assertIsNone(exporter.throttle_reason(200))
+
+    def test_retry_after_is_capped(self):
+        self.assertEqual(exporter.parse_retry_after('5'), 5.0)
+        self.assertEqual(exporter.parse_retry_after('86400'), exporter.MAX_RETRY_AFTER)
+        self.assertEqual(exporter.parse_retry_after('-3'), 0.0)
+        self.assertIsNone(exporter.parse_retry_after('soon'))
+
+
+if __name__ == '__main__':
+    unittest.main()
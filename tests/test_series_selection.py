@@ -0,0 +1,188 @@
+"""
+Tests of which per-VM series are exported: top-k selection, the series
+cap, and the fleet quantiles.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+
+import logging
+import math
+import os
+import sys
+import time
+import unittest
+from array import array
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import racknerd_exporter as exporter  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+NAN = math.nan
+# Series of a VM with stats: vm_info, stats_available, stats age, state and
+# three per group for bandwidth, disk and memory (vswap is unset)
+SERIES_PER_VM = 3 + 1 + 3 * 3
+
+
+def vm_stats(bw: int, disk: int, mem: int):
+    """A getstatsdiskusage response with the given usage percentages."""
+    return {
+        'success': '1', 'state': '1',
+        'totalbw': '1000 GB', 'usedbw': f'{bw * 10} GB', 'percentbw': str(bw),
+        'totalhdd': '40 GB', 'usedhdd': f'{disk * 0.4:.1f} GB', 'percenthdd': str(disk),
+        'totalmem': '2 GB', 'usedmem': f'{mem * 20} MB', 'percentmem': str(mem),
+        'totalvswap': 'null', 'usedvswap': 'null', 'percentvswap': '0',
+    }
+
+
+def make_poller(stats: dict) -> exporter.RackNerdPoller:
+    """A poller without a panel, publishing a snapshot of hostname -> stats (None: no stats)."""
+    vms = [{'vm_id': f'id-{hostname}', 'hostname': hostname, 'ip_address': f'10.0.0.{row}',
+            'os': 'Debian 12', 'vm_type': 'kvm'}
+           for row, hostname in enumerate(stats)]
+    poller = exporter.RackNerdPoller(client=None)
+    poller.inventory.get(lambda: vms)
+    for vm in vms:
+        if stats[vm['hostname']] is not None:
+            poller.stats_schedule.store(vm['vm_id'], stats[vm['hostname']], time.time())
+    poller.publish(0.0)
+    return poller
+
+
+def column(name: str) -> int:
+    return [metric.name for metric in exporter.STATS_METRICS].index(name)
+
+
+class TopRowsTest(unittest.TestCase):
+
+    def test_largest_values_in_row_order(self):
+        values = array('d', [5.0, 9.0, 1.0, 7.0])
+        self.assertEqual(exporter.top_rows(values, 2), [1, 3])
+        self.assertEqual(exporter.top_rows(values, 3), [0, 1, 3])
+
+    def test_nan_rows_are_excluded(self):
+        values = array('d', [NAN, 5.0, NAN, 1.0])
+        self.assertEqual(exporter.top_rows(values, 1), [1])
+        self.assertEqual(exporter.top_rows(values, 10), [1, 3])
+        self.assertEqual(exporter.top_rows(array('d', [NAN, NAN]), 2), [])
+
+
+class SelectRowsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.poller = make_poller({
+            'bw-heavy': vm_stats(bw=90, disk=10, mem=10),
+            'disk-heavy': vm_stats(bw=10, disk=90, mem=10),
+            'mem-heavy': vm_stats(bw=10, disk=10, mem=90),
+            'idle': vm_stats(bw=5, disk=5, mem=5),
+            'no-stats': None,
+        })
+
+    def test_without_top_k_every_vm_is_exported(self):
+        collector = exporter.RackNerdCollector({'main': self.poller})
+        rows, column_rows = collector.select_rows(self.poller.snapshot)
+        self.assertIsNone(rows)
+        self.assertEqual(column_rows, [None] * len(exporter.STATS_METRICS))
+
+    def test_each_group_keeps_its_own_top_vms(self):
+        collector = exporter.RackNerdCollector({'main': self.poller}, top_k=1)
+        _, column_rows = collector.select_rows(self.poller.snapshot)
+        for name in ('racknerd_bandwidth_total_bytes', 'racknerd_bandwidth_usage_percent'):
+            self.assertEqual(column_rows[column(name)], [0])
+        self.assertEqual(column_rows[column('racknerd_disk_used_bytes')], [1])
+        self.assertEqual(column_rows[column('racknerd_memory_usage_percent')], [2])
+        # vswap is unset on every VM
+        self.assertEqual(column_rows[column('racknerd_vswap_usage_percent')], [])
+
+    def test_other_families_cover_the_union_of_the_groups(self):
+        collector = exporter.RackNerdCollector({'main': self.poller}, top_k=1)
+        rows, column_rows = collector.select_rows(self.poller.snapshot)
+        self.assertEqual(rows, [0, 1, 2])
+        self.assertEqual(column_rows[column('racknerd_vm_state')], [0, 1, 2])
+
+    def test_union_does_not_repeat_vms_on_top_of_several_groups(self):
+        poller = make_poller({'busy': vm_stats(90, 90, 90), 'quiet': vm_stats(1, 1, 1)})
+        collector = exporter.RackNerdCollector({'main': poller}, top_k=1)
+        rows, _ = collector.select_rows(poller.snapshot)
+        self.assertEqual(rows, [0])
+
+
+class CapRowsTest(unittest.TestCase):
+
+    def series_by_vm(self, collector):
+        """Per-VM samples of one scrape, counted by (account, hostname)."""
+        snapshots = [(account, poller.snapshot) for account, poller in collector.pollers.items()]
+        families = [*collector.collect_scrape_vm_metrics(snapshots),
+                    *collector.collect_vm_metrics(snapshots)]
+        counts = Counter()
+        for family in families:
+            for sample in family.samples:
+                if 'hostname' in sample.labels:
+                    counts[(sample.labels['account'], sample.labels['hostname'])] += 1
+        return counts
+
+    def test_whole_vms_are_kept_within_the_budget(self):
+        poller = make_poller({f'vm{i}': vm_stats(10, 10, 10) for i in range(4)})
+        budget = 2 * SERIES_PER_VM + SERIES_PER_VM // 2
+        collector = exporter.RackNerdCollector({'main': poller}, max_series=budget)
+
+        counts = self.series_by_vm(collector)
+        self.assertEqual(counts, {('main', 'vm0'): SERIES_PER_VM, ('main', 'vm1'): SERIES_PER_VM})
+        self.assertEqual(collector.series_dropped, {'main': 2 * SERIES_PER_VM})
+
+    def test_smaller_vms_after_a_dropped_one_still_fit(self):
+        poller = make_poller({'big': vm_stats(10, 10, 10), 'empty': None})
+        snapshot = poller.snapshot
+        rows, column_rows, used, dropped = exporter.RackNerdCollector.cap_rows(
+            snapshot, None, [None] * len(exporter.STATS_METRICS), SERIES_PER_VM - 1)
+        # A VM without stats has vm_info, stats_available and its state
+        self.assertEqual(rows, [1])
+        self.assertEqual((used, dropped), (3, SERIES_PER_VM))
+        self.assertEqual(column_rows[column('racknerd_vm_state')], [1])
+
+    def test_budget_is_shared_across_accounts(self):
+        pollers = {
+            'first': make_poller({'a1': vm_stats(10, 10, 10), 'a2': vm_stats(10, 10, 10)}),
+            'second': make_poller({'b1': vm_stats(10, 10, 10), 'b2': vm_stats(10, 10, 10)}),
+        }
+        collector = exporter.RackNerdCollector(pollers, max_series=3 * SERIES_PER_VM)
+
+        counts = self.series_by_vm(collector)
+        self.assertEqual(set(counts), {('first', 'a1'), ('first', 'a2'), ('second', 'b1')})
+        self.assertTrue(all(count == SERIES_PER_VM for count in counts.values()))
+        self.assertEqual(collector.series_dropped, {'second': SERIES_PER_VM})
+
+        # Drops add up over scrapes
+        self.series_by_vm(collector)
+        self.assertEqual(collector.series_dropped, {'second': 2 * SERIES_PER_VM})
+
+    def test_cap_applies_after_top_k(self):
+        poller = make_poller({f'vm{i}': vm_stats(i, i, i) for i in range(4)})
+        collector = exporter.RackNerdCollector({'main': poller}, top_k=2, max_series=SERIES_PER_VM)
+        counts = self.series_by_vm(collector)
+        self.assertEqual(counts, {('main', 'vm2'): SERIES_PER_VM})
+        self.assertEqual(collector.series_dropped, {'main': SERIES_PER_VM})
+
+
+class QuantileTest(unittest.TestCase):
+
+    def test_single_value(self):
+        for q in (0.0, 0.5, 0.99, 1.0):
+            self.assertEqual(exporter.quantile([4.0], q), 4.0)
+
+    def test_two_values(self):
+        self.assertEqual(exporter.quantile([1.0, 3.0], 0.0), 1.0)
+        self.assertEqual(exporter.quantile([1.0, 3.0], 0.5), 2.0)
+        self.assertAlmostEqual(exporter.quantile([1.0, 3.0], 0.99), 2.98)
+        self.assertEqual(exporter.quantile([1.0, 3.0], 1.0), 3.0)
+
+    def test_interpolates_between_closest_ranks(self):
+        values = [10.0, 20.0, 30.0, 40.0, 50.0]
+        self.assertEqual(exporter.quantile(values, 0.5), 30.0)
+        self.assertEqual(exporter.quantile(values, 0.9), 46.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+Tests of panel size parsing.
+
+Run from the repository root with: python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import racknerd_exporter as exporter  # noqa: E402
+
+KIB = 1024
+GIB = 1024 ** 3
+
+
+class SizeParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = exporter.SizeParser()
+
+    def test_bytes(self):
+        self.assertEqual(self.parser.parse('512 B'), 512.0)
+        self.assertEqual(self.parser.parse('512B'), 512.0)
+
+    def test_binary_units(self):
+        for power, unit in enumerate(('KB', 'MB', 'GB', 'TB', 'PB'), 1):
+            with self.subTest(unit=unit):
+                self.assertEqual(self.parser.parse(f'2 {unit}'), 2 * 1024 ** power)
+
+    def test_iec_units(self):
+        for power, unit in enumerate(('KiB', 'MiB', 'GiB', 'TiB', 'PiB'), 1):
+            with self.subTest(unit=unit):
+                self.assertEqual(self.parser.parse(f'2 {unit}'), 2 * 1024 ** power)
+
+    def test_units_ignore_case(self):
+        self.assertEqual(self.parser.parse('5 kib'), 5 * KIB)
+        self.assertEqual(self.parser.parse('1.5 gb'), 1.5 * GIB)
+
+    def test_decimal_sizes(self):
+        parser = exporter.SizeParser(decimal=True)
+        for power, unit in enumerate(('KB', 'MB', 'GB', 'TB', 'PB'), 1):
+            with self.subTest(unit=unit):
+                self.assertEqual(parser.parse(f'2 {unit}'), 2 * 1000 ** power)
+        # IEC units stay binary
+        self.assertEqual(parser.parse('2 KiB'), 2 * KIB)
+        self.assertEqual(parser.parse('512 B'), 512.0)
+
+    def test_no_unit_is_gigabytes(self):
+        self.assertEqual(self.parser.parse('20.31'), 20.31 * GIB)
+        self.assertEqual(self.parser.parse('.5'), 0.5 * GIB)
+        self.assertEqual(exporter.SizeParser(decimal=True).parse('3'), 3 * 1000 ** 3)
+
+    def test_unset_and_unparsable_values_are_zero(self):
+        for value in ('null', '', None, 'GB', 'n/a', '-5 GB'):
+            with self.subTest(value=value):
+                self.assertEqual(self.parser.parse(value), 0.0)
+
+    def test_text_after_the_number_is_ignored(self):
+        # The second dot ends the number, so the unit is never reached
+        self.assertEqual(self.parser.parse('1.2.3 GB'), 1.2 * GIB)
+        self.assertEqual(self.parser.parse('40 GB (80%)'), 40 * GIB)
+
+    def test_short_values_are_cached(self):
+        value = '20.31 GB'
+        self.assertEqual(len(value), 8)
+        self.parser.parse(value)
+        self.parser.parse(value)
+        info = self.parser.cached.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+
+    def test_values_over_the_cutoff_skip_the_cache(self):
+        at_cutoff = '1'.rjust(exporter.MAX_CACHED_SIZE_LENGTH - 3, '0') + ' GB'
+        over_cutoff = '0' + at_cutoff
+        self.assertEqual(len(at_cutoff), exporter.MAX_CACHED_SIZE_LENGTH)
+
+        self.assertEqual(self.parser.parse(at_cutoff), GIB)
+        self.assertEqual(self.parser.cached.cache_info().currsize, 1)
+        self.assertEqual(self.parser.parse(over_cutoff), GIB)
+        self.assertEqual(self.parser.cached.cache_info().currsize, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()